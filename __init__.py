@@ -12,23 +12,182 @@ Date: 01/30/2024
 from flask import Flask
 import sqlite3
 
-# Function to create the Flask application
-def create_app():
+# Function to create the Flask application, with optional settings that override the defaults below
+def create_app(config=None):
     # Initialize the Flask app
     app = Flask(__name__)
 
     # Configuration settings for the app
     app.config['SECRET_KEY'] = '&jL82hB%#h@k!9l!h'
 
-    app.config['SESSION_TYPE'] = 'filesystem'
+    # Sessions are kept server-side in 'sqlite' (shared by every worker) or 'memory' (one worker), anything else keeps Flask's cookie sessions
+    app.config['SESSION_TYPE'] = 'sqlite'
     app.config['SESSION_PERMANENT'] = True
     app.config['SESSION_USE_SIGNER'] = True
 
+    # How often in seconds expired sessions are dropped
+    app.config['SESSION_SWEEP_INTERVAL'] = 300
+
+    # Database file, and the connection pool settings: idle connections kept, lock wait in seconds, memory-mapped bytes, and page cache KiB per connection
+    from .views import DATABASE
+    app.config['DATABASE'] = DATABASE
+    app.config['DATABASE_POOL_SIZE'] = 8
+    app.config['DATABASE_TIMEOUT'] = 5
+    app.config['DATABASE_MMAP_SIZE'] = 256 * 1024 * 1024
+    app.config['DATABASE_CACHE_SIZE'] = 16 * 1024
+
+    # Apply pending schema migrations when the app starts, otherwise they are applied with `flask migrate`
+    app.config['MIGRATE_ON_STARTUP'] = True
+
+    # Recommender settings: 'tfidf' or 'audio' mode, and the similarity and nearest-neighbour index used in audio mode
+    app.config['RECOMMENDER_MODE'] = 'tfidf'
+    app.config['RECOMMENDER_METRIC'] = 'euclidean'
+    app.config['RECOMMENDER_INDEX'] = 'ivf'
+    app.config['RECOMMENDER_LISTS'] = None
+    app.config['RECOMMENDER_PROBES'] = 8
+
+    # Size and lifetime in seconds of the per-playlist suggestion cache
+    app.config['RECOMMENDATION_CACHE_SIZE'] = 1024
+    app.config['RECOMMENDATION_CACHE_TTL'] = 600
+
+    # Worker processes that precompute suggestions in the background (0 computes them in the request), and their queue limit
+    app.config['RECOMMENDER_WORKERS'] = 0
+    app.config['RECOMMENDER_QUEUE_LIMIT'] = 256
+
+    # Search results shown per page, and the most a request may ask for
+    app.config['SEARCH_PAGE_SIZE'] = 50
+    app.config['SEARCH_MAX_PAGE_SIZE'] = 500
+
+    # Size and lifetime in seconds of the search result cache, and whether it is also shared between processes through the database
+    app.config['SEARCH_CACHE_SIZE'] = 512
+    app.config['SEARCH_CACHE_TTL'] = 3600
+    app.config['SEARCH_CACHE_SHARED'] = False
+
+    # Featured songs kept in memory and whether popular songs are featured more often, and how often in seconds the pool is reloaded and checked for catalogue edits
+    app.config['FEATURED_POOL_SIZE'] = 500
+    app.config['FEATURED_WEIGHTED'] = True
+    app.config['FEATURED_REFRESH_INTERVAL'] = 600
+    app.config['FEATURED_CHECK_INTERVAL'] = 30
+
+    # Suggestions returned by the search box autocomplete, how often in seconds it checks for catalogue edits made by other processes,
+    # and whether its index is built in the background when the app starts
+    app.config['AUTOCOMPLETE_SIZE'] = 10
+    app.config['AUTOCOMPLETE_CHECK_INTERVAL'] = 5
+    app.config['AUTOCOMPLETE_BUILD_ON_STARTUP'] = True
+
+    # How often in seconds the in-memory artists and albums that song rows are resolved against check for catalogue edits made by other processes
+    app.config['CATALOGUE_CHECK_INTERVAL'] = 5
+
+    # Rendered suggested-song blocks cached per worker and for how many seconds, reused while their page's version is unchanged
+    app.config['FRAGMENT_CACHE_SIZE'] = 1024
+    app.config['FRAGMENT_CACHE_TTL'] = 3600
+
+    # Most song ids a batch playlist edit may list
+    app.config['PLAYLIST_BATCH_LIMIT'] = 1000
+
+    # Rows inserted per transaction by the bulk catalogue import
+    app.config['IMPORT_BATCH_SIZE'] = 5000
+
+    # Record request, SQL, recommender stage, and template timings served on /metrics, and profile every Nth request with cProfile into PROFILE_DIR (0 turns profiling off)
+    app.config['METRICS_ENABLED'] = True
+    app.config['PROFILE_EVERY'] = 0
+    app.config['PROFILE_DIR'] = 'profiles'
+
+    # How workers start: 'lazy' loads the recommender on the first suggestion, 'preload' loads it before the server forks
+    # the workers (run it with a preloading server such as gunicorn --preload), and 'light' only serves precomputed suggestions
+    app.config['STARTUP_MODE'] = 'lazy'
+
+    # Apply overridden settings, such as another database for the benchmarks, before anything reads them
+    if config:
+        app.config.update(config)
+
     # Import and register blueprints (views and auth) from respective modules
     from .views import views
     from .auth import auth
     app.register_blueprint(views, url_prefix='/views')
     app.register_blueprint(auth, url_prefix='/auth')
 
+    # Measure every request, registered first so its timing covers the other hooks
+    from .metrics import init_metrics
+    init_metrics(app)
+
+    # Check out database connections from a pool that returns them when each app context ends
+    from .db import db_pool
+    db_pool.init_app(app)
+
+    # Bring the database up to the current schema
+    if app.config['MIGRATE_ON_STARTUP']:
+        from .migrations import migrate
+        migrate(app.config['DATABASE'])
+
+    # Keep session data on the server, the cookie only holds the session id
+    from .sessions import init_sessions
+    init_sessions(app)
+
+    # Apply the cache settings to this worker's caches
+    from .cache import recommendation_cache, search_cache, fragment_cache
+    recommendation_cache.configure(app.config['RECOMMENDATION_CACHE_SIZE'], app.config['RECOMMENDATION_CACHE_TTL'])
+    search_cache.configure(app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL'])
+    fragment_cache.configure(app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_TTL'])
+
+    # Let the background jobs read the recommender settings
+    from .jobs import recommendation_jobs
+    recommendation_jobs.init_app(app, app.config['DATABASE'])
+
+    # Let the autocomplete prefix index read its settings, it is built from the catalogue on the first lookup
+    from .autocomplete import autocomplete_index
+    autocomplete_index.init_app(app, app.config['DATABASE'])
+
+    # Load the artists and albums that song rows are resolved against instead of joining their tables
+    from .catalogue import catalogue_dimensions
+    catalogue_dimensions.init_app(app, app.config['DATABASE'])
+    conn = sqlite3.connect(app.config['DATABASE'])
+    catalogue_dimensions.load(conn.cursor())
+    conn.close()
+
+    # Let the featured song pool read its settings, it is loaded on the first home page visit
+    from .featured import featured_songs
+    featured_songs.init_app(app)
+
+    # Run the startup lifecycle of the configured mode, last so everything it warms is configured
+    from .startup import init_startup
+    init_startup(app)
+
+    # Register the commands that fit, save, and check the recommendation model
+    from .recommender import build_model_command, check_model_command, index_report_command
+    app.cli.add_command(build_model_command)
+    app.cli.add_command(check_model_command)
+    app.cli.add_command(index_report_command)
+
+    # Register the command that computes suggestions for every user's library
+    from .jobs import recommend_all_command
+    app.cli.add_command(recommend_all_command)
+
+    # Register the commands that apply the schema migrations and check the hot queries' plans
+    from .migrations import migrate_command, check_query_plans_command
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(check_query_plans_command)
+
+    # Register the commands that drop expired sessions and measure the session cost
+    from .sessions import sweep_sessions_command, session_report_command
+    app.cli.add_command(sweep_sessions_command)
+    app.cli.add_command(session_report_command)
+
+    # Register the command that rebuilds the search index
+    from .search import rebuild_search_index_command
+    app.cli.add_command(rebuild_search_index_command)
+
+    # Register the command that reports the time to first request in each startup mode
+    from .startup import startup_report_command
+    app.cli.add_command(startup_report_command)
+
+    # Register the command that bulk imports catalogue files
+    from .importer import import_catalogue_command
+    app.cli.add_command(import_catalogue_command)
+
+    # Register the command that reports the memory of the in-memory artists and albums
+    from .catalogue import catalogue_report_command
+    app.cli.add_command(catalogue_report_command)
+
     # Return the configured Flask app
     return app
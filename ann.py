@@ -0,0 +1,125 @@
+"""
+ann.py
+
+This file defines the nearest-neighbour indexes used by the recommender to look up songs with
+similar audio features. It includes an exact brute-force index, an approximate inverted-file
+index built with k-means partitioning, and a function to measure recall against exact search.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import time
+import numpy as np
+
+# Rows scored at once while assigning songs to partitions, bounds temporary memory
+CHUNK_SIZE = 65536
+
+# Function to compute squared euclidean distances from each row to each centroid
+def squared_distances(vectors, centroids):
+    return (np.einsum('ij,ij->i', vectors, vectors)[:, None]
+            - 2 * vectors @ centroids.T
+            + np.einsum('ij,ij->i', centroids, centroids)[None, :])
+
+# Function to pick the k smallest distances, ordered by distance then row
+def smallest_k(distances, candidates, k):
+    k = min(k, len(candidates))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(candidates):
+        part = np.argpartition(distances, k - 1)[:k]
+        distances, candidates = distances[part], candidates[part]
+    return candidates[np.lexsort((candidates, distances))]
+
+# Index that compares the query against every song
+class ExactIndex:
+    kind = 'exact'
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def search(self, query, k, probes=None):
+        diff = self.vectors - query
+        distances = np.einsum('ij,ij->i', diff, diff)
+        return smallest_k(distances, np.arange(len(self.vectors)), k)
+
+# Index that partitions songs around k-means centroids and only scans the closest partitions
+class IVFIndex:
+    kind = 'ivf'
+
+    def __init__(self, vectors, lists=None, probes=8, iterations=10, seed=42):
+        self.vectors = vectors
+        n = len(vectors)
+        self.lists = max(1, min(n, lists or int(np.sqrt(n))))
+        self.probes = probes
+        rng = np.random.default_rng(seed)
+
+        # Train the centroids on a sample, which is plenty for a few thousand partitions
+        sample_size = min(n, self.lists * 256)
+        sample = vectors[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = squared_distances(sample, centroids).argmin(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=self.lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.centroids = centroids
+
+        # Assign every song to its closest centroid, in chunks
+        assignment = np.empty(n, dtype=np.intp)
+        for start in range(0, n, CHUNK_SIZE):
+            chunk = vectors[start:start + CHUNK_SIZE]
+            assignment[start:start + CHUNK_SIZE] = squared_distances(chunk, centroids).argmin(axis=1)
+
+        # Store the partitions as one array of rows grouped by centroid plus offsets into it
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=self.lists))))
+
+    # Function to rebuild an index from arrays saved by an earlier build
+    @classmethod
+    def from_arrays(cls, vectors, centroids, order, offsets, probes=8):
+        index = cls.__new__(cls)
+        index.vectors = vectors
+        index.centroids = centroids
+        index.order = order
+        index.offsets = offsets
+        index.lists = len(centroids)
+        index.probes = probes
+        return index
+
+    def search(self, query, k, probes=None):
+        probes = min(self.lists, probes or self.probes)
+        centroid_distances = squared_distances(query[None, :], self.centroids)[0]
+        nearest_lists = np.argpartition(centroid_distances, probes - 1)[:probes]
+        candidates = np.concatenate(
+            [self.order[self.offsets[i]:self.offsets[i + 1]] for i in nearest_lists])
+        diff = self.vectors[candidates] - query
+        distances = np.einsum('ij,ij->i', diff, diff)
+        return smallest_k(distances, candidates, k)
+
+# Function to build an index of the given kind
+def build_index(kind, vectors, **params):
+    if kind == 'ivf':
+        return IVFIndex(vectors, **params)
+    return ExactIndex(vectors)
+
+# Function to measure recall@k and latency of an index against exact search
+def recall_report(index, probes_options, queries=200, k=10, seed=42):
+    vectors = index.vectors
+    rng = np.random.default_rng(seed)
+    query_rows = vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)]
+    exact = ExactIndex(vectors)
+
+    start = time.perf_counter()
+    truth = [set(exact.search(query, k).tolist()) for query in query_rows]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+
+    report = [{'probes': None, 'recall': 1.0, 'latency_ms': exact_ms}]
+    for probes in probes_options:
+        start = time.perf_counter()
+        results = [index.search(query, k, probes=probes) for query in query_rows]
+        latency_ms = (time.perf_counter() - start) * 1000 / len(query_rows)
+        hits = sum(len(expected.intersection(result.tolist())) for expected, result in zip(truth, results))
+        report.append({'probes': probes, 'recall': hits / (k * len(query_rows)), 'latency_ms': latency_ms})
+    return report
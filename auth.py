@@ -12,14 +12,12 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 import re
 import hashlib
 import secrets
-import sqlite3
+from .db import get_db
+from .sessions import regenerate_session
 
 # Create authentication blueprint
 auth = Blueprint('auth', __name__)
 
-# Set the database filename
-DATABASE = 'HarmonyVault.db'
-
 # Function to generate a random salt
 def generate_salt():
     return secrets.token_hex(16)
@@ -41,7 +39,7 @@ def login():
         username = request.form.get('username', '')
         password = request.form.get('password', '')
 
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cur = conn.cursor()
 
         user = cur.execute(
@@ -53,7 +51,8 @@ def login():
         if hashed_password != user[3]:
             flash('Email and password do not match.', category='error')
         else:
-            # Store user information in the session and redirect to the home page
+            # Store user information in the session under a new id and redirect to the home page
+            regenerate_session()
             flash('Login successful.', category='success')
             session['user'] = {
                 'user_id': user[0],
@@ -63,10 +62,8 @@ def login():
                 'admin': user[6]
             }
             cur.close()
-            conn.close()
             return redirect(url_for('views.home'))
         cur.close()
-        conn.close()
     return render_template('login.html')
 
 # Route for user signup
@@ -96,7 +93,7 @@ def signup():
             return redirect(url_for('auth.signup'))
         else:
             # Connect to the database
-            conn = sqlite3.connect(DATABASE)
+            conn = get_db()
             cur = conn.cursor()
 
             # Check if the username already exists
@@ -128,17 +125,16 @@ def signup():
                 except Exception:
                     flash('Error creating account.', category='error')
                 cur.close()
-                conn.close()
                 flash('Account creation successful.', category='success')
                 return redirect(url_for('auth.login'))
             cur.close()
-            conn.close()
     return render_template('signup.html')
 
 # Route for user logout
 @auth.route('logout')
 def logout():
     session.clear()
+    regenerate_session()
     return render_template('home.html')
 
 # Route for user account information
@@ -156,12 +152,12 @@ def account():
 def update_account():
     if request.method == 'POST':
         # Retrieve updated user information from the form
-        newUsername = request.form.get('newEmail', '')
-        newEmail = request.form.get('newFirstName', '')
+        newUsername = request.form.get('newUsername', '')
+        newEmail = request.form.get('newEmail', '')
         confirmPassword = request.form.get('confirmPassword', '')
 
         # Connect to the database
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cur = conn.cursor()
 
         # Retrieve user ID from the session
@@ -177,20 +173,22 @@ def update_account():
                     return redirect(url_for('auth.login'))
                 # Check if the new username already exists
                 user_check = cur.execute(
-                    'SELECT * FROM users WHERE username = ?', (newUsername,)).fetchone()
+                    'SELECT * FROM user WHERE username = ?', (newUsername,)).fetchone()
                 if user_check:
                     flash('Username already exists. Please try again.',
                           category='error')
                     return render_template('account.html', user=session['user'])
                 else:
                     cur.execute(
-                        'UPDATE users SET username= ? WHERE user_id = ?', (newUsername, user_id))
+                        'UPDATE user SET username= ? WHERE user_id = ?', (newUsername, user_id))
                     conn.commit()
                     session['user']['username'] = newUsername
+                    regenerate_session()
             elif newEmail:
                 cur.execute(
-                    'UPDATE users SET email = ? WHERE user_id = ?', (newEmail, user_id,))
+                    'UPDATE user SET email = ? WHERE user_id = ?', (newEmail, user_id,))
                 session['user']['email'] = newEmail
+                regenerate_session()
             elif confirmPassword:
                 user_data = cur.execute(
                     'SELECT * FROM user WHERE user_id = ?', (user_id,)).fetchone()
@@ -204,10 +202,8 @@ def update_account():
                     return redirect(url_for('auth.account'))
             conn.commit()
             cur.close()
-            conn.close()
         except Exception:
             cur.close()
-            conn.close()
             flash('Error updating account.', category="error")
             return redirect(url_for('auth.account'))
         flash('Account updated.', category='success')
@@ -216,19 +212,35 @@ def update_account():
 # Route for deleting user account
 @auth.route('/delete_account')
 def delete_account():
-    conn = sqlite3.connect(DATABASE)
+    user = session.get('user')
+    if not user:
+        return redirect(url_for('auth.login'))
+
+    conn = get_db()
     cur = conn.cursor()
 
-    user_id = session['user']['user_id']
+    user_id = user['user_id']
 
     try:
-        # Delete user account from the database
-        cur.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+        # Delete the user's playlists, with their songs, taste vectors, suggestions, and page versions, then the account
+        cur.execute('DELETE FROM playlist_songs WHERE playlist_id IN (SELECT playlist_id FROM playlist WHERE user_id = ?)', (user_id,))
+        cur.execute('DELETE FROM playlist_taste WHERE playlist_id IN (SELECT playlist_id FROM playlist WHERE user_id = ?)', (user_id,))
+        cur.execute('DELETE FROM playlist_recommendation WHERE playlist_id IN (SELECT playlist_id FROM playlist WHERE user_id = ?)', (user_id,))
+        cur.execute("DELETE FROM content_version WHERE kind = 'playlist' AND id IN (SELECT playlist_id FROM playlist WHERE user_id = ?)", (user_id,))
+        cur.execute("DELETE FROM content_version WHERE kind = 'user' AND id = ?", (user_id,))
+        cur.execute('DELETE FROM playlist WHERE user_id = ?', (user_id,))
+        cur.execute('DELETE FROM user WHERE user_id = ?', (user_id,))
         conn.commit()
     except Exception:
+        conn.rollback()
+        cur.close()
         flash('Error deleting account.', category='error')
-        return redirect(url_for('auth.login'))
+        return redirect(url_for('auth.account'))
+    cur.close()
 
+    # The deleted user is logged out
+    session.clear()
+    regenerate_session()
     flash('Account successfully deleted', category='success')
     return render_template('home.html')
 
@@ -253,7 +265,7 @@ def update_password():
             return redirect(url_for('auth.account'))
         else:
             user_id = user['user_id']
-            conn = sqlite3.connect(DATABASE)
+            conn = get_db()
             cur = conn.cursor()
 
             try:
@@ -269,7 +281,7 @@ def update_password():
                 return redirect(url_for('auth.account'))
 
             cur.close()
-            conn.close()
+            regenerate_session()
 
             flash('Password updated.', category='success')
             return redirect(url_for('auth.account'))
@@ -0,0 +1,359 @@
+"""
+autocomplete.py
+
+This file defines the in-memory prefix index behind the live suggestions of the search box.
+It includes song titles, album titles, and artist names kept in parallel arrays with one slot per
+record, every word of a name indexed as a slot and offset sorted for bisect so a prefix can match any
+of its words, the most popular matches of prefixes that match many names kept precomputed, and
+functions to build the index in a background thread while the old one keeps answering and to update
+single records after catalogue edits.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import bisect
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from array import array
+from .schema import get_catalogue_generation, table_exists
+
+# Queries that read each kind of record with its popularity, the highest popularity of its songs
+SOURCES = {
+    'song': '''SELECT song.song_id, song.title, COALESCE(MAX(song_data.popularity), 0) FROM song
+               LEFT JOIN song_data ON song_data.song_id = song.song_id {where} GROUP BY song.song_id''',
+    'album': '''SELECT album.album_id, album.title, COALESCE(MAX(song_data.popularity), 0) FROM album
+                LEFT JOIN song ON song.album_id = album.album_id
+                LEFT JOIN song_data ON song_data.song_id = song.song_id {where} GROUP BY album.album_id''',
+    'artist': '''SELECT artist.artist_id, artist.name, COALESCE(MAX(song_data.popularity), 0) FROM artist
+                 LEFT JOIN song ON song.artist_id = artist.artist_id
+                 LEFT JOIN song_data ON song_data.song_id = song.song_id {where} GROUP BY artist.artist_id''',
+}
+
+# Query that reads every song with its popularity and the album and artist the popularity counts for, used by builds
+BUILD_SONGS = '''SELECT song.song_id, song.title, COALESCE(MAX(song_data.popularity), 0), song.album_id, song.artist_id FROM song
+                 LEFT JOIN song_data ON song_data.song_id = song.song_id GROUP BY song.song_id'''
+
+# Prefixes matching more keys than this have their results precomputed, so no keystroke ranks more keys than this
+SCAN_LIMIT = 256
+
+# Largest string that sorts after every key starting with a prefix
+HIGHEST = '\U0010ffff'
+
+# Kinds of record, in the order results of equal popularity are listed
+KINDS = ['album', 'artist', 'song']
+
+# Function to normalize a name or query for prefix matching
+def normalize(text):
+    return ' '.join(str(text or '').lower().split())
+
+# Function to get the offsets of the keys a normalized name is indexed under, the start of each of its words
+def get_key_offsets(name):
+    if not name:
+        return []
+    return list(itertools.accumulate((len(word) + 1 for word in name.split(' ')[:-1]), initial=0))
+
+# Function to get the song ids, album id, and artist id whose popularity depends on a song
+def get_song_records(cur, song_id):
+    row = cur.execute('SELECT album_id, artist_id FROM song WHERE song_id = ?', (song_id,)).fetchone()
+    if not row:
+        return []
+    return [('song', song_id), ('album', row[0]), ('artist', row[1])]
+
+# Names of the catalogue in parallel arrays, one slot per record, and its keys as the slot and offset of each word of a
+# name, sorted by the name from that word on. No key is kept as a string of its own
+class PrefixTable:
+    def __init__(self):
+        self.names = []
+        self.texts = []
+        self.kinds = array('b')
+        self.ids = array('q')
+        self.popularity = []
+        self.slots = {kind: {} for kind in KINDS}
+        self.key_slots = array('I')
+        self.key_offsets = array('I')
+        self.top = {}
+
+    # Function to get the key at a position of the sorted keys
+    def key_at(self, position):
+        return self.names[self.key_slots[position]][self.key_offsets[position]:]
+
+    # Function to find the first position in a range of the sorted keys whose key is not below a string
+    def bisect(self, key, lo=0, hi=None):
+        hi = len(self.key_slots) if hi is None else hi
+        return bisect.bisect_left(range(len(self.key_slots)), key, lo, hi, key=self.key_at)
+
+    # Function to get the range of keys that start with a prefix
+    def get_range(self, prefix):
+        return self.bisect(prefix), self.bisect(prefix + HIGHEST)
+
+    # Function to get the order a record ranks in, most popular first
+    def rank_key(self, slot):
+        return -self.popularity[slot], self.kinds[slot], self.ids[slot]
+
+    # Function to rank the records of the keys in a range, one result per record
+    def rank(self, lo, hi, limit):
+        return heapq.nsmallest(limit, set(self.key_slots[lo:hi]), key=self.rank_key)
+
+    # Function to get the result of a record
+    def get_result(self, slot):
+        return {'type': KINDS[self.kinds[slot]], 'id': self.ids[slot], 'text': self.texts[slot],
+                'popularity': self.popularity[slot]}
+
+    # Function to give a record a slot, without indexing its keys
+    def put(self, kind, record_id, text, popularity):
+        name = normalize(text)
+        slot = len(self.names)
+        self.names.append(name)
+        self.texts.append(name if text == name else text)
+        self.kinds.append(KINDS.index(kind))
+        self.ids.append(record_id)
+        self.popularity.append(popularity)
+        self.slots[kind][record_id] = slot
+        return slot
+
+    # Function to add a record and index its keys, returning them
+    def add(self, kind, record_id, text, popularity):
+        slot = self.put(kind, record_id, text, popularity)
+        name = self.names[slot]
+        keys = []
+        for offset in get_key_offsets(name):
+            key = name[offset:]
+            position = self.bisect(key)
+            self.key_slots.insert(position, slot)
+            self.key_offsets.insert(position, offset)
+            keys.append(key)
+        return keys
+
+    # Function to remove a record's keys, returning them. Its slot is left empty until the next build
+    def remove(self, kind, record_id):
+        slot = self.slots[kind].pop(record_id, None)
+        if slot is None:
+            return []
+        name = self.names[slot]
+        keys = []
+        for offset in get_key_offsets(name):
+            key = name[offset:]
+            # Equal keys sit next to each other, one of them is this record's
+            position = self.bisect(key)
+            while position < len(self.key_slots) and self.key_slots[position] != slot:
+                position += 1
+            if position < len(self.key_slots):
+                del self.key_slots[position]
+                del self.key_offsets[position]
+            keys.append(key)
+        self.names[slot] = self.texts[slot] = ''
+        return keys
+
+    # Function to sort the keys of every record given a slot with put
+    def index_keys(self):
+        keys = [(slot, offset) for slot, name in enumerate(self.names) for offset in get_key_offsets(name)]
+        keys.sort(key=lambda key: self.names[key[0]][key[1]:])
+        self.key_slots = array('I', (slot for slot, _ in keys))
+        self.key_offsets = array('I', (offset for _, offset in keys))
+
+    # Function to precompute the results of every prefix matching more than SCAN_LIMIT keys
+    def compute_top(self, size):
+        # Find the wide prefixes one length at a time within the ranges of the shorter ones, with the parts of each range:
+        # the ranges of its one character longer prefixes, and the keys that are the prefix itself
+        wide = []
+        ranges = [('', 0, len(self.key_slots))]
+        while ranges:
+            longer = []
+            for prefix, lo, hi in ranges:
+                parts = []
+                start = lo
+                while start < hi:
+                    key = self.key_at(start)
+                    if len(key) == len(prefix):
+                        end = self.bisect(key + '\0', start, hi)
+                        parts.append((None, start, end))
+                    else:
+                        child = key[:len(prefix) + 1]
+                        end = self.bisect(child + HIGHEST, start, hi)
+                        if end - start > SCAN_LIMIT:
+                            longer.append((child, start, end))
+                            parts.append((child, start, end))
+                        else:
+                            parts.append((None, start, end))
+                    start = end
+                if prefix:
+                    wide.append((prefix, parts))
+            ranges = longer
+
+        # Rank the longest prefixes first, so each one merges the results of its wide parts with the records of the others
+        top = {}
+        for prefix, parts in reversed(wide):
+            candidates = set()
+            for child, start, end in parts:
+                candidates.update(self.key_slots[start:end] if child is None else top[child])
+            top[prefix] = heapq.nsmallest(size, candidates, key=self.rank_key)
+        self.top = top
+
+    # Function to recompute the precomputed results of the prefixes of some keys, dropping those no longer wide
+    def update_top(self, keys, size):
+        for key in set(keys):
+            for length in range(1, len(key) + 1):
+                prefix = key[:length]
+                lo, hi = self.get_range(prefix)
+                if hi - lo > SCAN_LIMIT:
+                    self.top[prefix] = self.rank(lo, hi, size)
+                else:
+                    # Longer prefixes of the key match no more keys than this one
+                    for longer in range(length, len(key) + 1):
+                        self.top.pop(key[:longer], None)
+                    break
+
+# Index of catalogue names, answering prefix queries with the most popular matches. It is built in a background
+# thread when the app starts, and rebuilt the same way while the current table keeps answering
+class PrefixIndex:
+    def __init__(self, size=10):
+        self.size = size
+        self.table = PrefixTable()
+        self.generation = None
+        self.database = None
+        self.check_interval = 5
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        self.building = False
+        self.stale = False
+        self.lookups = 0
+        self.lookup_time = 0.0
+        self.builds = 0
+        self.updates = 0
+
+    def init_app(self, app, database):
+        self.database = database
+        self.size = app.config['AUTOCOMPLETE_SIZE']
+        self.check_interval = app.config['AUTOCOMPLETE_CHECK_INTERVAL']
+        # Preloading builds it before the workers fork instead, a thread does not survive the fork
+        if app.config['AUTOCOMPLETE_BUILD_ON_STARTUP'] and app.config['STARTUP_MODE'] != 'preload':
+            self.schedule_build()
+
+    # Function to build the index from the catalogue, reading it in one transaction so the table matches its generation
+    def build(self, cur):
+        table = PrefixTable()
+        cur.execute('BEGIN')
+        try:
+            generation = get_catalogue_generation(cur)
+            if table_exists(cur, 'song'):
+                # Albums and artists take the highest popularity of their songs, gathered in one pass over the songs
+                popularity = {'album': {}, 'artist': {}}
+                for song_id, title, song_popularity, album_id, artist_id in cur.execute(BUILD_SONGS):
+                    table.put('song', song_id, title, song_popularity)
+                    for kind, record_id in (('album', album_id), ('artist', artist_id)):
+                        popularity[kind][record_id] = max(popularity[kind].get(record_id, 0), song_popularity)
+                for album_id, title in cur.execute('SELECT album_id, title FROM album'):
+                    table.put('album', album_id, title, popularity['album'].get(album_id, 0))
+                for artist_id, name in cur.execute('SELECT artist_id, name FROM artist'):
+                    table.put('artist', artist_id, name, popularity['artist'].get(artist_id, 0))
+        finally:
+            cur.connection.rollback()
+        table.index_keys()
+        table.compute_top(self.size)
+        with self.lock:
+            self.table = table
+            self.generation = generation
+            self.builds += 1
+
+    # Function to build the index from the app's database in the calling thread
+    def load(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            self.build(conn.cursor())
+        finally:
+            conn.close()
+
+    # Function to build the index in a background thread. A build asked for while one runs is made once it finishes,
+    # as the running one may have read the catalogue before the change it is asked for
+    def schedule_build(self):
+        with self.lock:
+            if self.database is None:
+                return
+            self.stale = True
+            if self.building:
+                return
+            self.building = True
+        threading.Thread(target=self.build_in_background, name='autocomplete-build', daemon=True).start()
+
+    def build_in_background(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.stale:
+                        break
+                    self.stale = False
+                self.load()
+        finally:
+            with self.lock:
+                self.building = False
+
+    # Function to reread changed records after a catalogue edit, rebuilding if another process also edited the catalogue
+    def refresh(self, cur, records):
+        generation = get_catalogue_generation(cur)
+        if self.generation is None or generation != self.generation + 1:
+            self.schedule_build()
+            return
+        rows = {}
+        for kind, record_id in records:
+            try:
+                record_id = int(record_id)
+            except (TypeError, ValueError):
+                continue
+            rows[(kind, record_id)] = cur.execute(
+                SOURCES[kind].format(where=f'WHERE {kind}.{kind}_id = ?'), (record_id,)).fetchone()
+        with self.lock:
+            changed_keys = []
+            for (kind, record_id), row in rows.items():
+                changed_keys.extend(self.table.remove(kind, record_id))
+                if row:
+                    changed_keys.extend(self.table.add(kind, row[0], row[1], row[2]))
+            self.table.update_top(changed_keys, self.size)
+            self.generation = generation
+            self.updates += 1
+
+    # Function to rebuild the index in the background when the catalogue changed in another process, checked every few
+    # seconds, or build it if it was not built when the app started
+    def check(self):
+        if self.database is None or time.monotonic() - self.checked_at < self.check_interval:
+            return
+        self.checked_at = time.monotonic()
+        conn = sqlite3.connect(self.database)
+        generation = get_catalogue_generation(conn.cursor())
+        conn.close()
+        if generation != self.generation:
+            self.schedule_build()
+
+    # Function to get the most popular songs, albums, and artists with a word starting with the query
+    def search(self, query, limit=10):
+        started = time.perf_counter()
+        prefix = normalize(query)
+        limit = max(0, min(limit, self.size))
+        with self.lock:
+            table = self.table
+            slots = table.top.get(prefix) if prefix else []
+            if slots is None:
+                slots = table.rank(*table.get_range(prefix), limit)
+            results = [table.get_result(slot) for slot in slots[:limit]]
+            self.lookups += 1
+            self.lookup_time += time.perf_counter() - started
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {
+                'keys': len(self.table.key_slots),
+                'records': sum(len(slots) for slots in self.table.slots.values()),
+                'precomputed': len(self.table.top),
+                'generation': self.generation,
+                'building': self.building,
+                'builds': self.builds,
+                'updates': self.updates,
+                'lookups': self.lookups,
+                'lookup_ms': self.lookup_time * 1000 / self.lookups if self.lookups else 0.0,
+            }
+
+# Prefix index of this web worker
+autocomplete_index = PrefixIndex()
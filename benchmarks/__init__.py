@@ -0,0 +1,14 @@
+"""
+benchmarks/__init__.py
+
+This package measures the application's hot paths. It includes a deterministic generator of
+synthetic catalogues at any scale, microbenchmarks of suggestions, search, and playlist pages
+driven through Flask's test client, and JSON results that can be compared between commits.
+
+Run it with `python -m website.benchmarks generate|run|compare`.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+from .generate import generate_catalogue
+from .run import run_benchmarks, compare_results
@@ -0,0 +1,66 @@
+"""
+benchmarks/__main__.py
+
+This file defines the command line of the benchmarks, run with `python -m website.benchmarks`.
+It includes commands to generate a synthetic catalogue, run the benchmarks against it and write
+their results as JSON, and compare two results, failing when a benchmark got slower.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import json
+import sys
+import click
+from .generate import generate_catalogue
+from .run import run_benchmarks, compare_results
+
+@click.group()
+def cli():
+    pass
+
+# Command to generate a synthetic catalogue database
+@cli.command('generate')
+@click.argument('database', type=click.Path(dir_okay=False))
+@click.option('--songs', type=click.IntRange(1), default=10000, help='Songs in the catalogue, from 10k up to millions.')
+@click.option('--users', type=click.IntRange(1), default=None, help='Users, each with a library, defaults to one per 500 songs.')
+@click.option('--playlist-size', type=click.IntRange(0), default=30, help='Average songs per playlist.')
+@click.option('--seed', type=int, default=0, help='Seed of the random generator, the same seed gives the same catalogue.')
+@click.option('--batch-size', type=click.IntRange(1), default=10000, help='Rows inserted per transaction.')
+def generate_command(database, songs, users, playlist_size, seed, batch_size):
+    try:
+        counts = generate_catalogue(database, songs, users, playlist_size, seed, batch_size)
+    except FileExistsError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Generated {counts["songs"]} songs, {counts["albums"]} albums, {counts["artists"]} artists, '
+               f'{counts["users"]} users, and {counts["playlists"]} playlists in {counts["seconds"]:.1f}s.')
+
+# Command to run the benchmarks against a database and write the results
+@cli.command('run')
+@click.argument('database', type=click.Path(exists=True, dir_okay=False))
+@click.option('--repeat', type=click.IntRange(1), default=50, help='Timed calls per benchmark.')
+@click.option('--warmup', type=click.IntRange(0), default=3, help='Untimed calls before each benchmark.')
+@click.option('--mode', type=click.Choice(['tfidf', 'audio']), default='tfidf', help='Recommender mode benchmarked.')
+@click.option('--output', type=click.File('w'), default='-', help='File the JSON results are written to, defaults to stdout.')
+def run_command(database, repeat, warmup, mode, output):
+    results = run_benchmarks(database, repeat, warmup, {'RECOMMENDER_MODE': mode})
+    json.dump(results, output, indent=2)
+    output.write('\n')
+    for name, result in results['benchmarks'].items():
+        click.echo(f'{name:<16} median {result["median_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms', err=True)
+
+# Command to compare two results, failing when a benchmark's median got slower than the threshold allows
+@cli.command('compare')
+@click.argument('baseline', type=click.File())
+@click.argument('current', type=click.File())
+@click.option('--threshold', type=float, default=0.1, help='Largest allowed slowdown, as a fraction of the baseline.')
+def compare_command(baseline, current, threshold):
+    baseline, current = json.load(baseline), json.load(current)
+    rows = compare_results(baseline, current, threshold)
+    click.echo(f'{"benchmark":<16} {baseline.get("commit") or "baseline":>10} {current.get("commit") or "current":>10} {"change":>8}')
+    for row in rows:
+        click.echo(f'{row["name"]:<16} {row["baseline_ms"]:>8.2f}ms {row["current_ms"]:>8.2f}ms {row["change"]:>+8.1%}'
+                   f'{"  REGRESSED" if row["regressed"] else ""}')
+    if any(row['regressed'] for row in rows):
+        sys.exit(1)
+
+cli()
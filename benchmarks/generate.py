@@ -0,0 +1,129 @@
+"""
+benchmarks/generate.py
+
+This file defines the generator of synthetic catalogues for the benchmarks.
+It writes artists, albums, songs, song_data features, users, playlists, and playlist songs to a new
+database in batches, drawn from a seeded random generator so the same scale and seed always give
+the same database, and then applies the application's migrations.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import itertools
+import os
+import random
+import sqlite3
+import time
+from ..auth import hash_password
+from ..migrations import migrate
+
+# Catalogue and user tables as the application expects them before its migrations run
+BASE_TABLES = [
+    'CREATE TABLE user (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, email TEXT, hashed_password TEXT, salt TEXT, date_of_birth TEXT, admin INTEGER)',
+    'CREATE TABLE artist (artist_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, genre TEXT)',
+    'CREATE TABLE album (album_id INTEGER PRIMARY KEY AUTOINCREMENT, artist_id INTEGER, title TEXT, release_date TEXT, image_url TEXT)',
+    'CREATE TABLE song (song_id INTEGER PRIMARY KEY AUTOINCREMENT, album_id INTEGER, artist_id INTEGER, title TEXT, genre TEXT, spotify_url TEXT)',
+    'CREATE TABLE song_data (title TEXT, artist TEXT, popularity INTEGER, danceability REAL, energy REAL, loudness REAL, speechiness REAL, acousticness REAL, instrumentalness REAL, liveness REAL, valence REAL)',
+    'CREATE TABLE playlist (playlist_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, title TEXT, description TEXT, image_url TEXT)',
+    'CREATE TABLE playlist_songs (playlist_id INTEGER, song_id INTEGER)',
+]
+
+# Words that titles and names are made of, so searches and autocomplete find realistic numbers of matches
+WORDS = ('love night blue fire dream heart rain dance wild gold sun moon river city road home light dark star sky '
+         'summer winter ocean storm silver golden broken electric midnight neon velvet shadow echo ghost paper '
+         'diamond thunder sweet lonely young forever crazy little hollow burning falling rising').split()
+
+GENRES = ['pop', 'rock', 'hip hop', 'r&b', 'country', 'electronic', 'jazz', 'indie', 'metal', 'folk']
+
+# Password of every generated user, so the benchmark database can be logged into
+PASSWORD = 'benchmark'
+
+# Function to make a title of a few random words
+def make_title(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+# Function to insert rows from a generator in batches, each in its own transaction
+def insert_rows(conn, statement, rows, batch_size):
+    count = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return count
+        conn.executemany(statement, batch)
+        conn.commit()
+        count += len(batch)
+
+# Function to generate a catalogue of the given number of songs and users into a new database, returning row counts and timing
+def generate_catalogue(path, songs=10000, users=None, playlist_size=30, seed=0, batch_size=10000):
+    if os.path.exists(path):
+        raise FileExistsError(f'{path} already exists.')
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    artists = max(1, songs // 20)
+    albums = max(1, songs // 10)
+    users = users if users is not None else max(20, songs // 500)
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    for statement in BASE_TABLES:
+        conn.execute(statement)
+
+    # Artist names are kept to label their songs' features, album artists to credit their songs
+    artist_names = [f'{make_title(rng, 2)} {artist_id}' for artist_id in range(1, artists + 1)]
+    insert_rows(conn, 'INSERT INTO artist (artist_id, name, genre) VALUES (?, ?, ?)',
+                ((artist_id, name, rng.choice(GENRES)) for artist_id, name in enumerate(artist_names, 1)), batch_size)
+    album_artists = [rng.randint(1, artists) for _ in range(albums)]
+    insert_rows(conn, 'INSERT INTO album (album_id, artist_id, title, release_date, image_url) VALUES (?, ?, ?, ?, ?)',
+                ((album_id, artist_id, make_title(rng, rng.randint(1, 3)), f'{rng.randint(1960, 2025)}-01-01',
+                  f'https://images.example.com/album/{album_id}.jpg')
+                 for album_id, artist_id in enumerate(album_artists, 1)), batch_size)
+
+    # Songs and their features come from one draw per song, a few titles repeat the way covers and remasters do
+    def song_rows():
+        for song_id in range(1, songs + 1):
+            album_id = rng.randint(1, albums)
+            artist_id = album_artists[album_id - 1]
+            title = make_title(rng, rng.randint(1, 4)) if rng.random() < 0.3 else f'{make_title(rng, 2)} {song_id}'
+            yield ((song_id, album_id, artist_id, title, rng.choice(GENRES), f'https://open.spotify.com/track/{song_id}'),
+                   (title, artist_names[artist_id - 1], int(100 * rng.random() ** 2), round(rng.random(), 3),
+                    round(rng.random(), 3), round(-60 * rng.random() ** 3, 2), round(rng.random() / 3, 3),
+                    round(rng.random(), 3), round(rng.random() ** 4, 3), round(rng.random() / 2, 3), round(rng.random(), 3)))
+
+    rows = song_rows()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        conn.executemany('INSERT INTO song (song_id, album_id, artist_id, title, genre, spotify_url) VALUES (?, ?, ?, ?, ?, ?)',
+                         [song for song, _ in batch])
+        conn.executemany('INSERT INTO song_data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [data for _, data in batch])
+        conn.commit()
+
+    # Every user has a library, and every other user a second playlist
+    salt = f'{seed:032x}'
+    password = hash_password(PASSWORD, salt)
+    insert_rows(conn, 'INSERT INTO user (user_id, username, email, hashed_password, salt, date_of_birth, admin) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((user_id, f'user_{user_id:05d}', f'user_{user_id:05d}@example.com', password, salt, '2000-01-01',
+                  1 if user_id == 1 else 0) for user_id in range(1, users + 1)), batch_size)
+    playlists = [(user_id, 'Library') for user_id in range(1, users + 1)] + \
+                [(user_id, 'Mix') for user_id in range(1, users + 1, 2)]
+    insert_rows(conn, 'INSERT INTO playlist (playlist_id, user_id, title, description, image_url) VALUES (?, ?, ?, ?, ?)',
+                ((playlist_id, user_id, title, f'{title} of user {user_id}', f'https://images.example.com/playlist/{playlist_id}.jpg')
+                 for playlist_id, (user_id, title) in enumerate(playlists, 1)), batch_size)
+    insert_rows(conn, 'INSERT INTO playlist_songs (playlist_id, song_id) VALUES (?, ?)',
+                ((playlist_id, song_id) for playlist_id in range(1, len(playlists) + 1)
+                 for song_id in rng.sample(range(1, songs + 1), min(songs, rng.randint(0, 2 * playlist_size)))), batch_size)
+    conn.close()
+
+    # Bring the new database up to the application's schema, as startup would
+    migrate(path)
+    return {
+        'artists': artists,
+        'albums': albums,
+        'songs': songs,
+        'users': users,
+        'playlists': len(playlists),
+        'seed': seed,
+        'seconds': time.perf_counter() - started,
+    }
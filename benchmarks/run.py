@@ -0,0 +1,138 @@
+"""
+benchmarks/run.py
+
+This file defines the microbenchmarks of the application's hot paths.
+It includes benchmarks of playlist suggestions, search, and playlist page rendering driven through
+Flask's test client against a generated catalogue, timing statistics written as JSON together with
+the commit and environment they were measured on, and a comparison of two results that flags
+regressions.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import time
+from .. import create_app
+from ..cache import recommendation_cache, popular_songs_cache, search_cache, fragment_cache
+from ..recommender import load_model, load_feature_store, reset_model
+from ..views import get_recommended_songs
+from .generate import WORDS
+
+# Function to get the commit the package is checked out at, None outside a git checkout
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Function to summarize timings in milliseconds
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'mean_ms': statistics.fmean(timings),
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min_ms': timings[0],
+        'max_ms': timings[-1],
+    }
+
+# Function to time a function over a rotating list of arguments, after untimed warmup calls
+def time_calls(function, arguments, repeat, warmup):
+    for i in range(warmup):
+        function(arguments[i % len(arguments)])
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        function(arguments[i % len(arguments)])
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+# Function to fail a benchmark on an error response instead of timing it
+def check_response(response):
+    if response.status_code != 200:
+        raise RuntimeError(f'{response.request.path} answered {response.status_code}')
+    return response
+
+# Function to run every benchmark against a database, returning the results with the environment they were measured in
+def run_benchmarks(database, repeat=50, warmup=3, config=None):
+    settings = {'DATABASE': database, 'RECOMMENDER_WORKERS': 0}
+    settings.update(config or {})
+    started = time.perf_counter()
+    app = create_app(settings)
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    conn = sqlite3.connect(database)
+    songs = conn.execute('SELECT COUNT(*) FROM song').fetchone()[0]
+    user_id, playlist_id = conn.execute('SELECT user_id, playlist_id FROM playlist WHERE user_id = 1').fetchone()
+    # Suggestions need songs to start from, so the playlists benchmarked are the largest ones
+    playlist_ids = [row[0] for row in conn.execute(
+        'SELECT playlist_id FROM playlist_songs GROUP BY playlist_id ORDER BY COUNT(*) DESC, playlist_id LIMIT 20')]
+    conn.close()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'user_id': user_id, 'username': f'user_{user_id:05d}', 'email': '', 'date_of_birth': '', 'admin': 1}
+
+    # Loading the model is timed once, it happens on each worker's first suggestion
+    reset_model()
+    started = time.perf_counter()
+    with app.app_context():
+        if app.config['RECOMMENDER_MODE'] == 'audio':
+            load_feature_store(database)
+        else:
+            load_model(database)
+    model_load_ms = (time.perf_counter() - started) * 1000
+
+    def recommendations(playlist_id):
+        recommendation_cache.clear()
+        with app.app_context():
+            get_recommended_songs(playlist_id)
+
+    def search(query):
+        search_cache.clear()
+        check_response(client.post('/views/search', data={'search': query}))
+
+    def playlist_page(playlist_id):
+        recommendation_cache.clear()
+        popular_songs_cache.clear()
+        fragment_cache.clear()
+        check_response(client.get(f'/views/playlist_songs/{playlist_id}'))
+
+    queries = [WORDS[i] for i in range(0, len(WORDS), 3)] + [f'{WORDS[i]} {WORDS[i + 1]}' for i in range(0, 12, 2)]
+    results = {
+        'recommendations': time_calls(recommendations, playlist_ids, repeat, warmup),
+        'search': time_calls(search, queries, repeat, warmup),
+        'playlist_page': time_calls(playlist_page, playlist_ids, repeat, warmup),
+    }
+    return {
+        'commit': get_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'database': os.path.abspath(database),
+        'songs': songs,
+        'recommender_mode': app.config['RECOMMENDER_MODE'],
+        'repeat': repeat,
+        'startup_ms': startup_ms,
+        'model_load_ms': model_load_ms,
+        'benchmarks': results,
+    }
+
+# Function to compare the median timings of two results, listing each benchmark's change and whether it regressed
+def compare_results(baseline, current, threshold=0.1):
+    rows = []
+    for name, result in current['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0.0
+        rows.append({'name': name, 'baseline_ms': before['median_ms'], 'current_ms': result['median_ms'],
+                     'change': change, 'regressed': change > threshold})
+    return rows
@@ -0,0 +1,92 @@
+"""
+cache.py
+
+This file defines the in-process caches used by the views blueprint.
+It includes a bounded LRU cache with time-to-live expiry, per-entry versions, and hit/miss
+counters, along with the caches of suggested songs for each playlist, of the most popular songs,
+of search results, and of rendered fragments.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import time
+import threading
+from collections import OrderedDict
+
+# Bounded cache that evicts the least recently used entry, entries also expire after ttl seconds
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Function to change the size and expiry of the cache, dropping entries over the new size
+    def configure(self, maxsize, ttl):
+        with self.lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Function to get a value, an entry stored under another version counts as a miss
+    def get(self, key, version=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, entry_version, expires = entry
+                if entry_version == version and (expires is None or expires > time.monotonic()):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, version=None):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (value, version, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Function to report the counters used to size the cache
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# Suggested songs by playlist id, validated against the playlist's content version
+recommendation_cache = LRUCache()
+
+# Most popular songs, shown while a playlist's suggestions are computed in the background
+popular_songs_cache = LRUCache(maxsize=1, ttl=600)
+
+# Pages of search results by normalized query, validated against the catalogue generation
+search_cache = LRUCache(maxsize=512, ttl=3600)
+
+# Rendered HTML fragments by template and record id, validated against the version of the page they are part of
+fragment_cache = LRUCache(maxsize=1024, ttl=3600)
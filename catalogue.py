@@ -0,0 +1,235 @@
+"""
+catalogue.py
+
+This file defines the in-memory catalogue dimensions used to resolve song rows.
+It includes compact records of every artist and album kept in dicts keyed by id, loaded when the
+app starts and updated record by record after catalogue edits, functions that add the artist and
+album columns to song rows read without joining their tables, and a CLI command that reports the
+memory the dimensions take per million songs.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from operator import attrgetter
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .schema import get_catalogue_generation
+
+# Columns of a song row, followed by the album and artist it references
+SONG_COLUMNS = 6
+SONG_ALBUM_ID = 1
+SONG_ARTIST_ID = 2
+
+# Artist of the catalogue, with the columns of its table
+class Artist:
+    __slots__ = ('artist_id', 'name', 'genre')
+
+    def __init__(self, artist_id, name, genre):
+        self.artist_id = artist_id
+        self.name = name
+        self.genre = genre
+
+# Album of the catalogue, with the columns of its table
+class Album:
+    __slots__ = ('album_id', 'artist_id', 'title', 'release_date', 'image_url')
+
+    def __init__(self, album_id, artist_id, title, release_date, image_url):
+        self.album_id = album_id
+        self.artist_id = artist_id
+        self.title = title
+        self.release_date = release_date
+        self.image_url = image_url
+
+# Queries that read each kind of record, in the order of its record's fields
+SOURCES = {
+    'artist': (Artist, 'SELECT artist_id, name, genre FROM artist'),
+    'album': (Album, 'SELECT album_id, artist_id, title, release_date, image_url FROM album'),
+}
+
+# Queries that read one record of a kind by id, and the records of a kind whose ids are listed in a JSON array
+RECORD_QUERIES = {kind: f'{query} WHERE {kind}_id = ?' for kind, (_, query) in SOURCES.items()}
+LISTED_RECORDS_QUERIES = {kind: f'{query} WHERE {kind}_id IN (SELECT value FROM json_each(?))'
+                          for kind, (_, query) in SOURCES.items()}
+
+# Columns added to song rows by most reads: artist name, album title, and album image
+SONG_FIELDS = (('artist', 'name'), ('album', 'title'), ('album', 'image_url'))
+
+# Every artist column then every album column, as in a join selecting artist.* and album.*
+ALL_FIELDS = tuple(('artist', name) for name in Artist.__slots__) + tuple(('album', name) for name in Album.__slots__)
+
+# Function to load the records of a kind into a dict keyed by id, so its size follows the records and not their highest id
+def load_records(cur, kind):
+    record_class, query = SOURCES[kind]
+    return {row[0]: record_class(*row) for row in cur.execute(query)}
+
+# Artists and albums of the catalogue, which song rows are resolved against instead of joining their tables
+class CatalogueDimensions:
+    def __init__(self):
+        self.artists = {}
+        self.albums = {}
+        self.generation = None
+        self.database = None
+        self.check_interval = 5
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.updates = 0
+        self.misses = 0
+        self.resolved = 0
+
+    def init_app(self, app, database):
+        self.database = database
+        self.check_interval = app.config['CATALOGUE_CHECK_INTERVAL']
+
+    # Function to load every artist and album of the catalogue
+    def load(self, cur):
+        artists = load_records(cur, 'artist')
+        albums = load_records(cur, 'album')
+        with self.lock:
+            self.artists = artists
+            self.albums = albums
+            self.generation = get_catalogue_generation(cur)
+            self.checked_at = time.monotonic()
+            self.loads += 1
+
+    # Function to store a record, or drop it when it no longer exists
+    def put(self, kind, record_id, row):
+        records = self.artists if kind == 'artist' else self.albums
+        if row is None:
+            records.pop(record_id, None)
+            return
+        records[record_id] = SOURCES[kind][0](*row)
+
+    # Function to reread changed records after a catalogue edit, reloading if another process also edited the catalogue
+    def refresh(self, cur, records):
+        generation = get_catalogue_generation(cur)
+        if self.generation is None or generation != self.generation + 1:
+            self.load(cur)
+            return
+        rows = {}
+        for kind, record_id in records:
+            if kind not in SOURCES:
+                continue
+            try:
+                record_id = int(record_id)
+            except (TypeError, ValueError):
+                continue
+            rows[(kind, record_id)] = cur.execute(RECORD_QUERIES[kind], (record_id,)).fetchone()
+        with self.lock:
+            for (kind, record_id), row in rows.items():
+                self.put(kind, record_id, row)
+            self.generation = generation
+            self.updates += 1
+
+    # Function to reload the dimensions when the catalogue changed in another process, checked every few seconds
+    def check(self):
+        if self.database is None or time.monotonic() - self.checked_at < self.check_interval:
+            return
+        self.checked_at = time.monotonic()
+        conn = sqlite3.connect(self.database)
+        cur = conn.cursor()
+        if self.generation is None or get_catalogue_generation(cur) != self.generation:
+            self.load(cur)
+        cur.close()
+        conn.close()
+
+    # Function to read artists and albums that songs reference but were added since the last load, such as by another process.
+    # It runs on its own cursor, so the caller's cursor can still be fetching song rows
+    def load_missing(self, conn, artist_ids, album_ids):
+        rows = []
+        cur = conn.cursor()
+        for kind, record_ids in (('artist', artist_ids), ('album', album_ids)):
+            if record_ids:
+                rows.extend((kind, row) for row in cur.execute(
+                    LISTED_RECORDS_QUERIES[kind], (json.dumps(sorted(record_ids)),)).fetchall())
+        cur.close()
+        with self.lock:
+            for kind, row in rows:
+                self.put(kind, row[0], row)
+            self.misses += len(artist_ids) + len(album_ids)
+
+    # Function to add artist and album columns after the song columns of each row, rows of unknown artists or albums are left out as by a join
+    def resolve(self, cur, rows, fields=SONG_FIELDS):
+        self.check()
+        artists, albums = self.artists, self.albums
+        missing_artists = {row[SONG_ARTIST_ID] for row in rows
+                           if row[SONG_ARTIST_ID] is not None and row[SONG_ARTIST_ID] not in artists}
+        missing_albums = {row[SONG_ALBUM_ID] for row in rows
+                          if row[SONG_ALBUM_ID] is not None and row[SONG_ALBUM_ID] not in albums}
+        if missing_artists or missing_albums:
+            self.load_missing(cur.connection, missing_artists, missing_albums)
+            artists, albums = self.artists, self.albums
+
+        getters = [(kind == 'album', attrgetter(name)) for kind, name in fields]
+        resolved = []
+        for row in rows:
+            artist = artists.get(row[SONG_ARTIST_ID])
+            album = albums.get(row[SONG_ALBUM_ID])
+            if artist is None or album is None:
+                continue
+            resolved.append(row[:SONG_COLUMNS] + tuple(getter(album if is_album else artist) for is_album, getter in getters)
+                            + row[SONG_COLUMNS:])
+        self.resolved += len(resolved)
+        return resolved
+
+    def stats(self):
+        with self.lock:
+            return {
+                'artists': len(self.artists),
+                'albums': len(self.albums),
+                'generation': self.generation,
+                'loads': self.loads,
+                'updates': self.updates,
+                'misses': self.misses,
+                'resolved': self.resolved,
+            }
+
+# Catalogue dimensions of this web worker
+catalogue_dimensions = CatalogueDimensions()
+
+# Function to estimate the bytes held by a dict of records, counting each distinct string once
+def get_records_size(records):
+    size = sys.getsizeof(records)
+    seen = set()
+    for record_id, record in records.items():
+        size += sys.getsizeof(record_id) + sys.getsizeof(record)
+        for name in record.__slots__:
+            value = getattr(record, name)
+            if id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+    return size
+
+# CLI command to report the memory taken by the catalogue dimensions, in total and per million songs
+@click.command('catalogue-report')
+@with_appcontext
+def catalogue_report_command():
+    conn = sqlite3.connect(current_app.config['DATABASE'])
+    cur = conn.cursor()
+    songs = cur.execute('SELECT COUNT(*) FROM song').fetchone()[0]
+
+    # Measure what a fresh load allocates, then break it down by kind
+    tracemalloc.start()
+    dimensions = CatalogueDimensions()
+    dimensions.load(cur)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    cur.close()
+    conn.close()
+
+    scale = 1000000 / songs if songs else 0
+    click.echo(f'{"kind":<8} {"records":>10} {"bytes":>12} {"bytes/record":>13} {"per 1M songs":>13} {"MiB per 1M songs":>17}')
+    for kind, records in (('artist', dimensions.artists), ('album', dimensions.albums)):
+        count = len(records)
+        size = get_records_size(records)
+        click.echo(f'{kind:<8} {count:>10} {size:>12} {size / max(count, 1):>13.0f} {count * scale:>13.0f} '
+                   f'{size * scale / 2 ** 20:>17.1f}')
+    click.echo(f'Loading {songs} songs\' artists and albums allocated {allocated / 2 ** 20:.1f} MiB, '
+               f'{allocated * scale / 2 ** 20:.1f} MiB per million songs at this catalogue\'s artist and album ratios.')
@@ -0,0 +1,108 @@
+"""
+db.py
+
+This file defines the database access layer shared by the blueprints.
+It includes a pool of SQLite connections that are reused across requests, each set up once with
+WAL journaling, NORMAL syncing, memory-mapped I/O, and a larger page cache, and a function that gives
+the current app context its connection and returns it to the pool when the context ends.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import os
+import sqlite3
+import threading
+from flask import g
+from .metrics import InstrumentedConnection
+
+# Pool of open connections to the app's database, one checked out per app context
+class ConnectionPool:
+    def __init__(self):
+        self.config = {}
+        self.database = None
+        self.pid = os.getpid()
+        self.idle = []
+        self.lock = threading.Lock()
+        self.created = 0
+        self.checkouts = 0
+        self.reused = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.discarded = 0
+
+    def init_app(self, app):
+        self.config = app.config
+        app.teardown_appcontext(close_db)
+
+    # Function to open a connection and apply the connection settings
+    def connect(self):
+        # With metrics enabled every query run through the pool is timed
+        factory = InstrumentedConnection if self.config.get('METRICS_ENABLED') else sqlite3.Connection
+        conn = sqlite3.connect(self.config['DATABASE'], timeout=self.config['DATABASE_TIMEOUT'], check_same_thread=False,
+                               factory=factory)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f"PRAGMA mmap_size = {int(self.config['DATABASE_MMAP_SIZE'])}")
+        conn.execute(f"PRAGMA cache_size = {-int(self.config['DATABASE_CACHE_SIZE'])}")
+        self.created += 1
+        return conn
+
+    # Function to check out an idle connection, opening a new one if there is none
+    def acquire(self):
+        with self.lock:
+            if self.pid != os.getpid() or self.database != self.config['DATABASE']:
+                # Connections opened before a fork or for another database are never reused
+                self.pid = os.getpid()
+                self.database = self.config['DATABASE']
+                self.idle = []
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop()
+            try:
+                return self.connect()
+            except Exception:
+                self.in_use -= 1
+                raise
+
+    # Function to return a connection to the pool, dropping anything it left uncommitted
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            self.in_use -= 1
+            if len(self.idle) < self.config['DATABASE_POOL_SIZE'] and self.pid == os.getpid():
+                self.idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'pool_size': self.config.get('DATABASE_POOL_SIZE'),
+                'created': self.created,
+                'checkouts': self.checkouts,
+                'reused': self.reused,
+                'discarded': self.discarded,
+            }
+
+# Connection pool of this worker
+db_pool = ConnectionPool()
+
+# Function to get the connection of the current app context, checking one out of the pool on first use
+def get_db():
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+# Function to return the app context's connection to the pool when the context ends
+def close_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
@@ -0,0 +1,107 @@
+"""
+feature_store.py
+
+This file defines the flat binary file that holds the recommender's audio feature matrix, the
+song id each row is linked to when it was built, the standardization parameters, and the nearest-neighbour index partitions. The file is opened with
+numpy.memmap, so every worker process on a host shares the same page cache pages, and it is
+replaced atomically whenever the model is rebuilt.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import os
+import struct
+import threading
+import numpy as np
+from .ann import ExactIndex, IVFIndex
+
+# File layout: a fixed size header followed by the arrays, each aligned to 64 bytes
+MAGIC = b'HVFEAT02'
+HEADER = struct.Struct('<8sQIIII')
+HEADER_SIZE = 64
+ALIGNMENT = 64
+
+# Codes stored in the header for the similarity metric and index kind
+METRICS = ['euclidean', 'cosine']
+INDEX_KINDS = ['exact', 'ivf']
+
+# Feature stores opened by this worker process, by path
+_stores = {}
+_stores_lock = threading.Lock()
+
+# Memory-mapped feature matrix, song ids, and index of one store file
+class FeatureStore:
+    def __init__(self, path, probes=8):
+        self.path = path
+
+        # Map every array from the same open file, so a concurrent swap cannot mix two versions
+        with open(path, 'rb') as f:
+            self.stat_key = get_stat_key(os.fstat(f.fileno()))
+            magic, count, lists, dimensions, metric, kind = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a feature store file.')
+            self.metric = METRICS[metric]
+
+            offset = HEADER_SIZE
+            self.features, offset = map_array(f, np.float32, (count, dimensions), offset)
+            self.ids, offset = map_array(f, np.int64, (count,), offset)
+            self.mean, offset = map_array(f, np.float64, (dimensions,), offset)
+            self.std, offset = map_array(f, np.float64, (dimensions,), offset)
+            if INDEX_KINDS[kind] == 'ivf':
+                centroids, offset = map_array(f, np.float32, (lists, dimensions), offset)
+                order, offset = map_array(f, np.int64, (count,), offset)
+                offsets, offset = map_array(f, np.int64, (lists + 1,), offset)
+                self.index = IVFIndex.from_arrays(self.features, centroids, order, offsets, probes)
+            else:
+                self.index = ExactIndex(self.features)
+
+# Function to identify a version of the file, it changes whenever the file is replaced
+def get_stat_key(stat):
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Function to map one array of the file, returning the aligned offset of the next array
+def map_array(f, dtype, shape, offset):
+    if not all(shape):
+        return np.empty(shape, dtype=dtype), offset
+    array = np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return array, aligned(offset + array.nbytes)
+
+# Function to round an offset up to the array alignment
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+# Function to write a store file next to the destination and move it into place atomically
+def write_feature_store(path, features, ids, mean, std, metric='euclidean', index=None):
+    features = np.ascontiguousarray(features, dtype=np.float32)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    kind = index.kind if index is not None else 'exact'
+    lists = index.lists if kind == 'ivf' else 0
+    arrays = [features, ids, np.ascontiguousarray(mean, dtype=np.float64),
+              np.ascontiguousarray(std, dtype=np.float64)]
+    if kind == 'ivf':
+        arrays += [np.ascontiguousarray(index.centroids, dtype=np.float32),
+                   np.ascontiguousarray(index.order, dtype=np.int64),
+                   np.ascontiguousarray(index.offsets, dtype=np.int64)]
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(ids), lists, features.shape[1],
+                            METRICS.index(metric), INDEX_KINDS.index(kind)).ljust(HEADER_SIZE, b'\0'))
+        for array in arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * (aligned(f.tell()) - f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Function to get the store for a path, mapping it again if the file was replaced since
+def get_feature_store(path, probes=8):
+    store = _stores.get(path)
+    if store is not None and store.stat_key == get_stat_key(os.stat(path)):
+        return store
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None or store.stat_key != get_stat_key(os.stat(path)):
+            store = FeatureStore(path, probes)
+            _stores[path] = store
+    return store
@@ -0,0 +1,139 @@
+"""
+featured.py
+
+This file defines the pool of featured songs shown on the home page.
+It includes a pool of song rows with their artist and album preloaded from the catalogue and
+refreshed by a background thread, and constant-time sampling from it, uniform or weighted by
+popularity with the alias method, so picking a featured song never queries the database.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import os
+import random
+import threading
+import time
+from .catalogue import catalogue_dimensions
+from .db import db_pool
+from .schema import get_catalogue_generation
+
+# Function to build alias method tables, which sample index i with probability weights[i] / sum(weights) in constant time
+def build_alias_table(weights):
+    n = len(weights)
+    total = sum(weights)
+    scaled = [weight * n / total for weight in weights]
+    probabilities = [1.0] * n
+    aliases = list(range(n))
+    small = [i for i, weight in enumerate(scaled) if weight < 1]
+    large = [i for i, weight in enumerate(scaled) if weight >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    return probabilities, aliases
+
+# Pool of featured song rows, refreshed in the background by each worker process
+class FeaturedSongs:
+    def __init__(self):
+        self.config = {}
+        self.songs = []
+        self.probabilities = []
+        self.aliases = []
+        self.generation = None
+        self.loaded_at = 0
+        self.pid = None
+        self.wake_event = threading.Event()
+        self.lock = threading.Lock()
+        self.refreshes = 0
+        self.samples = 0
+
+    def init_app(self, app):
+        self.config = app.config
+
+    # Function to load a new pool of random songs with their popularity from the catalogue
+    def refresh(self):
+        conn = db_pool.acquire()
+        try:
+            cur = conn.cursor()
+            generation = get_catalogue_generation(cur)
+            rows = cur.execute(
+                'SELECT song.*, COALESCE(song_data.popularity, 0) FROM song LEFT JOIN song_data ON song_data.song_id = song.song_id WHERE EXISTS (SELECT 1 FROM album WHERE album.album_id = song.album_id) AND EXISTS (SELECT 1 FROM artist WHERE artist.artist_id = song.artist_id) ORDER BY RANDOM() LIMIT ?',
+                (self.config['FEATURED_POOL_SIZE'],)).fetchall()
+            rows = catalogue_dimensions.resolve(cur, rows)
+            cur.close()
+        finally:
+            db_pool.release(conn)
+
+        # Every song keeps a chance to be featured, popular songs get a larger one
+        weights = [max(row[-1], 0) + 1 if self.config['FEATURED_WEIGHTED'] else 1 for row in rows]
+        probabilities, aliases = build_alias_table(weights) if rows else ([], [])
+        with self.lock:
+            self.songs = [row[:-1] for row in rows]
+            self.probabilities = probabilities
+            self.aliases = aliases
+            self.generation = generation
+            self.loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    # Function to start this process's refresh thread, which reloads the pool on a timer or after a catalogue edit
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self.run, daemon=True, name='featured-songs').start()
+
+    def run(self):
+        while True:
+            self.wake_event.wait(self.config['FEATURED_CHECK_INTERVAL'])
+            woken = self.wake_event.is_set()
+            self.wake_event.clear()
+            try:
+                expired = time.monotonic() - self.loaded_at >= self.config['FEATURED_REFRESH_INTERVAL']
+                if woken or expired or self.catalogue_changed():
+                    self.refresh()
+            except Exception:
+                # Keep serving the current pool, the next check tries again
+                pass
+
+    # Function to check whether another process edited the catalogue since the pool was loaded
+    def catalogue_changed(self):
+        conn = db_pool.acquire()
+        try:
+            return get_catalogue_generation(conn.cursor()) != self.generation
+        finally:
+            db_pool.release(conn)
+
+    # Function to ask the refresh thread to reload the pool now, used after catalogue edits
+    def wake(self):
+        self.wake_event.set()
+
+    # Function to pick a featured song row, None if the catalogue has no songs
+    def sample(self):
+        if self.pid != os.getpid():
+            if not self.songs:
+                self.refresh()
+            self.start()
+        with self.lock:
+            songs, probabilities, aliases = self.songs, self.probabilities, self.aliases
+            self.samples += 1
+        if not songs:
+            return None
+        i = random.randrange(len(songs))
+        return songs[i] if random.random() < probabilities[i] else songs[aliases[i]]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pool': len(self.songs),
+                'weighted': self.config.get('FEATURED_WEIGHTED'),
+                'generation': self.generation,
+                'refreshes': self.refreshes,
+                'samples': self.samples,
+                'age_seconds': time.monotonic() - self.loaded_at if self.refreshes else None,
+            }
+
+# Featured song pool of this web worker
+featured_songs = FeaturedSongs()
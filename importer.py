@@ -0,0 +1,269 @@
+"""
+importer.py
+
+This file defines the bulk import of catalogue data.
+It includes functions to stream artist, album, song, and song_data records from CSV or JSON-lines
+files without reading a whole file into memory, an importer that resolves artist, album, and song
+references through in-memory lookup maps and inserts the records in large batched transactions,
+and a CLI command that imports files and reports rows per second.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import csv
+import io
+import json
+import sqlite3
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import db_pool
+from .recommender import FEATURES
+from .schema import bump_catalogue_generation
+
+# Kinds of records, in the order they have to be imported so references resolve
+KINDS = ['artist', 'album', 'song', 'song_data']
+
+# Statements that insert each kind of record, ids are assigned by the importer so the lookup maps need no queries
+INSERTS = {
+    'artist': 'INSERT INTO artist (artist_id, name, genre) VALUES (?, ?, ?)',
+    'album': 'INSERT INTO album (album_id, artist_id, title, release_date, image_url) VALUES (?, ?, ?, ?, ?)',
+    'song': 'INSERT INTO song (song_id, album_id, artist_id, title, genre, spotify_url) VALUES (?, ?, ?, ?, ?, ?)',
+    'song_data': f'INSERT INTO song_data (song_id, title, artist, {", ".join(FEATURES)}) VALUES (?, ?, ?, {", ".join(["?"] * len(FEATURES))})',
+}
+
+# Function to guess a file's format from its name
+def get_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+# Function to read records one at a time from a text stream of CSV with a header row, or of one JSON object per line
+def read_records(stream, format='csv'):
+    if format == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError(f'Line {number} is not a JSON object.')
+                yield record
+    else:
+        yield from csv.DictReader(stream)
+
+# Function to get an integer field, None when it is missing or empty
+def get_int(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        return None
+    return int(value)
+
+# Function to get a numeric field, None when it is missing or empty
+def get_number(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        return None
+    return float(value)
+
+# Importer of catalogue records into one database connection
+class CatalogueImporter:
+    def __init__(self, conn, batch_size=5000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.maps = {}
+        self.next_ids = {}
+
+    # Function to load the lookup map of a kind of record, and the next free id for it
+    def get_map(self, kind):
+        if kind in self.maps:
+            return self.maps[kind]
+        cur = self.conn.cursor()
+        if kind == 'artist':
+            lookup = {name: artist_id for artist_id, name in cur.execute('SELECT artist_id, name FROM artist')}
+        elif kind == 'album':
+            lookup = {(artist_id, title): album_id for album_id, artist_id, title in
+                      cur.execute('SELECT album_id, artist_id, title FROM album')}
+        elif kind == 'song':
+            lookup = {}
+            for song_id, artist_id, title in cur.execute('SELECT song_id, artist_id, title FROM song ORDER BY song_id'):
+                lookup.setdefault((artist_id, title), song_id)
+                lookup.setdefault(title, song_id)
+        else:
+            lookup = set(cur.execute('SELECT title, artist FROM song_data'))
+        if kind != 'song_data':
+            self.next_ids[kind] = cur.execute(f'SELECT COALESCE(MAX({kind}_id), 0) + 1 FROM {kind}').fetchone()[0]
+        cur.close()
+        self.maps[kind] = lookup
+        return lookup
+
+    # Function to take the next free id of a kind of record
+    def take_id(self, kind):
+        record_id = self.next_ids[kind]
+        self.next_ids[kind] += 1
+        return record_id
+
+    # Function to find an artist by id or name
+    def resolve_artist(self, record):
+        artist_id = get_int(record, 'artist_id')
+        return artist_id if artist_id is not None else self.get_map('artist').get(record.get('artist'))
+
+    # Function to turn a record into the row to insert, or a reason to skip it; rows already in the catalogue give None
+    def prepare(self, kind, record):
+        if kind == 'artist':
+            artists = self.get_map('artist')
+            if not record.get('name'):
+                return 'missing name'
+            if record['name'] in artists:
+                return None
+            artists[record['name']] = artist_id = self.take_id('artist')
+            return (artist_id, record['name'], record.get('genre'))
+
+        if kind == 'album':
+            albums = self.get_map('album')
+            artist_id = self.resolve_artist(record)
+            if artist_id is None:
+                return 'unknown artist'
+            if not record.get('title'):
+                return 'missing title'
+            if (artist_id, record['title']) in albums:
+                return None
+            albums[(artist_id, record['title'])] = album_id = self.take_id('album')
+            return (album_id, artist_id, record['title'], record.get('release_date'), record.get('image_url'))
+
+        if kind == 'song':
+            songs = self.get_map('song')
+            artist_id = self.resolve_artist(record)
+            album_id = get_int(record, 'album_id')
+            if album_id is None:
+                album_id = self.get_map('album').get((artist_id, record.get('album')))
+            if artist_id is None:
+                return 'unknown artist'
+            if album_id is None:
+                return 'unknown album'
+            if not record.get('title'):
+                return 'missing title'
+            if (artist_id, record['title']) in songs:
+                return None
+            songs[(artist_id, record['title'])] = song_id = self.take_id('song')
+            songs.setdefault(record['title'], song_id)
+            return (song_id, album_id, artist_id, record['title'], record.get('genre'), record.get('spotify_url'))
+
+        features = self.get_map('song_data')
+        if not record.get('title'):
+            return 'missing title'
+        if (record['title'], record.get('artist')) in features:
+            return None
+        features.add((record['title'], record.get('artist')))
+        # Link the features to the song with the same title, preferring the same artist
+        songs = self.get_map('song')
+        artist_id = self.get_map('artist').get(record.get('artist'))
+        song_id = songs.get((artist_id, record['title']), songs.get(record['title']))
+        return (song_id, record['title'], record.get('artist')) + tuple(get_number(record, feature) for feature in FEATURES)
+
+    # Function to import a stream of records of one kind in batched transactions, returning counts and timing.
+    # A stream that cannot be read or a batch that cannot be written stops the import, with the error in the report
+    def import_records(self, kind, records):
+        started = time.perf_counter()
+        report = {'kind': kind, 'read': 0, 'inserted': 0, 'existing': 0, 'skipped': {}}
+        batch = []
+        cur = self.conn.cursor()
+        try:
+            for record in records:
+                report['read'] += 1
+                try:
+                    row = self.prepare(kind, record)
+                except (TypeError, ValueError):
+                    row = 'invalid value'
+                if row is None:
+                    report['existing'] += 1
+                elif isinstance(row, str):
+                    report['skipped'][row] = report['skipped'].get(row, 0) + 1
+                else:
+                    batch.append(row)
+                    if len(batch) >= self.batch_size:
+                        report['inserted'] += self.write(cur, kind, batch)
+                        batch = []
+            if batch:
+                report['inserted'] += self.write(cur, kind, batch)
+        except (ValueError, csv.Error, sqlite3.Error) as e:
+            # Batches written before the error stay committed, 'inserted' only counts those
+            self.conn.rollback()
+            report['error'] = str(e)
+        cur.close()
+        report['seconds'] = time.perf_counter() - started
+        report['rows_per_second'] = report['read'] / max(report['seconds'], 1e-9)
+        return report
+
+    # Function to insert one batch in its own transaction
+    def write(self, cur, kind, batch):
+        cur.executemany(INSERTS[kind], batch)
+        self.conn.commit()
+        return len(batch)
+
+    # Function to start a new catalogue generation once the import is done, so cached catalogue data is reloaded
+    def finish(self):
+        cur = self.conn.cursor()
+        bump_catalogue_generation(cur)
+        self.conn.commit()
+        cur.close()
+
+# Function to wrap an uploaded file as a text stream, read in chunks straight from the upload
+def get_text_stream(file):
+    return io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
+
+# Function to import a file stream of one kind of record
+def import_stream(kind, stream, format='csv', batch_size=5000):
+    conn = db_pool.acquire()
+    importer = CatalogueImporter(conn, batch_size)
+    try:
+        return importer.import_records(kind, read_records(stream, format))
+    finally:
+        # Even a stopped import may have committed batches, which cached catalogue data has to pick up
+        importer.finish()
+        db_pool.release(conn)
+
+# Function to format an import report for the command line
+def format_report(report):
+    skipped = ', '.join(f'{count} {reason}' for reason, count in report['skipped'].items())
+    stopped = f', stopped: {report["error"]}' if 'error' in report else ''
+    return (f'{report["kind"]}: read {report["read"]}, inserted {report["inserted"]}, '
+            f'already present {report["existing"]}, skipped {sum(report["skipped"].values())}'
+            f'{f" ({skipped})" if skipped else ""} in {report["seconds"]:.2f}s, '
+            f'{report["rows_per_second"]:.0f} rows/sec{stopped}')
+
+# CLI command to import catalogue files
+@click.command('import-catalogue')
+@click.option('--artists', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON-lines file of artists.')
+@click.option('--albums', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON-lines file of albums.')
+@click.option('--songs', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON-lines file of songs.')
+@click.option('--song-data', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON-lines file of song features.')
+@click.option('--batch-size', type=int, default=None, help='Rows inserted per transaction, defaults to the IMPORT_BATCH_SIZE setting.')
+@with_appcontext
+def import_catalogue_command(artists, albums, songs, song_data, batch_size):
+    files = dict(zip(KINDS, [artists, albums, songs, song_data]))
+    if not any(files.values()):
+        raise click.UsageError('Give at least one of --artists, --albums, --songs, or --song-data.')
+
+    started = time.perf_counter()
+    total = 0
+    conn = db_pool.acquire()
+    try:
+        # One importer keeps the lookup maps of earlier files for the references of later ones
+        importer = CatalogueImporter(conn, batch_size or current_app.config['IMPORT_BATCH_SIZE'])
+        try:
+            for kind, path in files.items():
+                if path:
+                    with open(path, newline='', encoding='utf-8') as stream:
+                        report = importer.import_records(kind, read_records(stream, get_format(path)))
+                    total += report['read']
+                    click.echo(format_report(report))
+                    # Later files may reference the records this one did not import
+                    if 'error' in report:
+                        raise click.ClickException(f'Import of {path} stopped after {report["inserted"]} inserted rows.')
+        finally:
+            importer.finish()
+    finally:
+        db_pool.release(conn)
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'Imported {total} rows in {elapsed:.2f}s, {total / max(elapsed, 1e-9):.0f} rows/sec.')
+    if songs or song_data:
+        click.echo('Run `flask build-model` to include the new songs in suggestions.')
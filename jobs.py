@@ -0,0 +1,308 @@
+"""
+jobs.py
+
+This file defines the background jobs that precompute song suggestions for playlists.
+It includes a process pool that recomputes suggestions for playlists that changed recently,
+with a queue depth limit and coalescing of duplicate jobs, a CLI command that scores every
+user's library in vectorized batches, and functions to read and write the precomputed
+suggestions in the playlist_recommendation table.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import sqlite3
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .catalogue import catalogue_dimensions
+from .schema import bump_playlist_version
+
+# Flask app of a pool worker process, created once by the pool initializer
+_worker_app = None
+
+# Model and playlists shared with the batch scoring processes, which inherit them when forked
+_batch = {}
+
+# Function to format a playlist version for storage
+def format_version(version):
+    return str(version)
+
+# Function to read a playlist's precomputed suggestions, and whether they match its current contents
+def read_recommendations(cur, playlist_id, version):
+    rows = cur.execute(
+        'SELECT song.*, playlist_recommendation.version FROM playlist_recommendation JOIN song ON playlist_recommendation.song_id = song.song_id WHERE playlist_recommendation.playlist_id = ? ORDER BY playlist_recommendation.rank',
+        (playlist_id,)).fetchall()
+    rows = catalogue_dimensions.resolve(cur, rows)
+    if not rows:
+        return None, False
+    return [row[:-1] for row in rows], rows[0][-1] == format_version(version)
+
+# Function to replace a playlist's precomputed suggestions, computed from the given version of it
+def write_recommendations(cur, playlist_id, version, song_ids):
+    computed_at = time.time()
+    cur.execute('DELETE FROM playlist_recommendation WHERE playlist_id = ?', (playlist_id,))
+    # Writing them bumps the playlist's version once, so they match the version it has afterwards unless it was edited
+    # while they were computed
+    cur.executemany(
+        'INSERT INTO playlist_recommendation (playlist_id, rank, song_id, version, computed_at) VALUES (?, ?, ?, ?, ?)',
+        [(playlist_id, rank, song_id, format_version(version + 1), computed_at)
+         for rank, song_id in enumerate(song_ids)])
+    # Pages showing the playlist's suggestions are out of date once new ones are written
+    bump_playlist_version(cur, playlist_id)
+
+# Function to drop a playlist's precomputed suggestions
+def delete_recommendations(cur, playlist_id):
+    cur.execute('DELETE FROM playlist_recommendation WHERE playlist_id = ?', (playlist_id,))
+
+# Function to set up a pool worker process with the parent app's settings, including its database
+def init_worker(config):
+    global _worker_app
+    from . import create_app
+    _worker_app = create_app(config)
+
+# Function run in a pool worker to recompute and store one playlist's suggestions
+def run_job(database, playlist_id):
+    from .recommender import get_playlist_version, recommend_songs
+
+    with _worker_app.app_context():
+        conn = sqlite3.connect(database)
+        cur = conn.cursor()
+        try:
+            version = get_playlist_version(cur, playlist_id)
+            recommended_songs = recommend_songs(cur, playlist_id, database)
+            write_recommendations(cur, playlist_id, version, [song[0] for song in recommended_songs])
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    return len(recommended_songs)
+
+# Queue of playlists whose suggestions are recomputed by a pool of worker processes
+class RecommendationJobs:
+    def __init__(self):
+        self.config = {}
+        self.database = None
+        self.executor = None
+        self.pending = {}
+        self.rerun = set()
+        self.lock = threading.Lock()
+        self.scheduled = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def init_app(self, app, database):
+        self.config = app.config
+        self.database = database
+
+    # Function to queue a recompute, returns False when jobs are disabled or the queue is full
+    def schedule(self, playlist_id):
+        workers = self.config.get('RECOMMENDER_WORKERS')
+        if not workers:
+            return False
+        try:
+            playlist_id = int(playlist_id)
+        except (TypeError, ValueError):
+            return False
+
+        with self.lock:
+            future = self.pending.get(playlist_id)
+            if future is not None:
+                # A burst of edits schedules one job, plus one rerun if the job had already started
+                if future.running():
+                    self.rerun.add(playlist_id)
+                self.coalesced += 1
+                return True
+            if len(self.pending) >= self.config['RECOMMENDER_QUEUE_LIMIT']:
+                self.rejected += 1
+                return False
+            if self.executor is None:
+                # Workers compute in process, skip the migrations the parent already applied, and never answer autocomplete
+                settings = dict(self.config, RECOMMENDER_WORKERS=0, MIGRATE_ON_STARTUP=False,
+                                AUTOCOMPLETE_BUILD_ON_STARTUP=False)
+                # Workers start in a fresh interpreter, forking a web worker would copy its threads' locks mid-use
+                self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=init_worker, initargs=(settings,))
+            try:
+                future = self.executor.submit(run_job, self.database, playlist_id)
+            except BrokenProcessPool:
+                # A worker died, so the next job starts a new pool and this playlist keeps its current suggestions
+                self.executor.shutdown(wait=False)
+                self.executor = None
+                self.failed += 1
+                return False
+            self.pending[playlist_id] = future
+            self.scheduled += 1
+        future.add_done_callback(partial(self.finished, playlist_id))
+        return True
+
+    def finished(self, playlist_id, future):
+        with self.lock:
+            self.pending.pop(playlist_id, None)
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+            rerun = playlist_id in self.rerun
+            self.rerun.discard(playlist_id)
+        if rerun:
+            self.schedule(playlist_id)
+
+    # Function to wait until every queued job has finished
+    def wait(self):
+        while True:
+            with self.lock:
+                futures = list(self.pending.values())
+            if not futures:
+                return
+            for future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'queue_limit': self.config.get('RECOMMENDER_QUEUE_LIMIT'),
+                'scheduled': self.scheduled,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+# Background jobs of this web worker
+recommendation_jobs = RecommendationJobs()
+
+# Function to score a chunk of playlists by TF-IDF similarity as one catalogue x playlists product
+def score_tfidf_chunk(start, stop, count=10):
+    import numpy as np
+    from .recommender import get_song_indices, rank_song_ids
+
+    model = _batch['model']
+    matrix = model['matrix']
+    playlists = _batch['playlists'][start:stop]
+    queries = np.zeros((len(playlists), matrix.shape[1]))
+    for row, (_, song_ids) in enumerate(playlists):
+        song_indices = get_song_indices(model, song_ids)
+        if song_indices:
+            queries[row] = np.asarray(matrix[song_indices].sum(axis=0)).ravel()
+
+    scores = np.asarray(matrix @ queries.T).T
+    return [(playlist_id, rank_song_ids(model, scores[row], count))
+            for row, (playlist_id, _) in enumerate(playlists)]
+
+# Function to score a chunk of playlists by distance between their taste vectors and every song's audio features
+def score_audio_chunk(start, stop, count=10):
+    import numpy as np
+    from .ann import squared_distances, smallest_k
+
+    store = _batch['store']
+    features = store.features
+    playlists = _batch['playlists'][start:stop]
+    queries = np.zeros((len(playlists), features.shape[1]), dtype=np.float32)
+    for row, (_, _, song_count, feature_sum) in enumerate(playlists):
+        if song_count:
+            queries[row] = (feature_sum / song_count - store.mean) / store.std
+    if store.metric == 'cosine':
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        queries /= norms
+
+    distances = squared_distances(queries, features)
+    rows = np.arange(len(features))
+    results = []
+    for row, (playlist_id, song_ids, _, _) in enumerate(playlists):
+        # Leave out the playlist's own songs
+        excluded = [i for song_id in song_ids for i in _batch['song_rows'].get(song_id, [])]
+        distances[row, excluded] = np.inf
+        nearest = smallest_k(distances[row], rows, count + len(excluded))
+        # Excluded rows are infinitely far, so they are only among the nearest when too few songs are left
+        nearest = nearest[distances[row, nearest] < np.inf]
+        ranked = dict.fromkeys(_batch['row_song_ids'][i] for i in nearest)
+        results.append((playlist_id, [song_id for song_id in ranked if song_id is not None][:count]))
+    return results
+
+# CLI command to compute suggestions for every user's library in one run
+@click.command('recommend-all')
+@click.option('--chunk-size', type=int, default=32, help='Playlists scored per catalogue pass, bounds memory.')
+@click.option('--workers', type=int, default=1, help='Processes to split the chunks across.')
+@with_appcontext
+def recommend_all_command(chunk_size, workers):
+    from .recommender import load_model, load_feature_store
+    from .taste import get_taste
+
+    database = current_app.config['DATABASE']
+    started = time.perf_counter()
+    conn = sqlite3.connect(database)
+    cur = conn.cursor()
+    mode = current_app.config['RECOMMENDER_MODE']
+
+    # Load the model and every library's songs once
+    playlist_ids = [row[0] for row in cur.execute("SELECT playlist_id FROM playlist WHERE title = 'Library'").fetchall()]
+    song_ids = {playlist_id: [] for playlist_id in playlist_ids}
+    for playlist_id, song_id in cur.execute(
+            "SELECT playlist_songs.playlist_id, playlist_songs.song_id FROM playlist_songs JOIN playlist ON playlist_songs.playlist_id = playlist.playlist_id WHERE playlist.title = 'Library'").fetchall():
+        song_ids[playlist_id].append(song_id)
+    versions = dict(cur.execute(
+        "SELECT playlist.playlist_id, content_version.version FROM playlist JOIN content_version ON content_version.kind = 'playlist' AND content_version.id = playlist.playlist_id WHERE playlist.title = 'Library'").fetchall())
+
+    if mode == 'audio':
+        store = load_feature_store(database)
+        row_song_ids = [song_id if song_id >= 0 else None for song_id in store.ids.tolist()]
+        song_rows = {}
+        for row, song_id in enumerate(row_song_ids):
+            song_rows.setdefault(song_id, []).append(row)
+        _batch.update(store=store, row_song_ids=row_song_ids, song_rows=song_rows,
+                      playlists=[(playlist_id, song_ids[playlist_id]) + get_taste(cur, playlist_id)
+                                 for playlist_id in playlist_ids])
+        score_chunk = score_audio_chunk
+    else:
+        _batch.update(model=load_model(database),
+                      playlists=[(playlist_id, song_ids[playlist_id]) for playlist_id in playlist_ids])
+        score_chunk = score_tfidf_chunk
+    loaded = time.perf_counter()
+
+    # Score the playlists in chunks, forked workers share the loaded model
+    chunks = [(start, min(start + chunk_size, len(playlist_ids))) for start in range(0, len(playlist_ids), chunk_size)]
+    results = []
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            for chunk_results in executor.map(score_chunk, *zip(*chunks)):
+                results.extend(chunk_results)
+    else:
+        for start, stop in chunks:
+            results.extend(score_chunk(start, stop))
+    _batch.clear()
+    scored = time.perf_counter()
+
+    # Write every playlist's suggestions in one transaction, matching the version each one has after the bump below
+    computed_at = time.time()
+    rows = [(playlist_id, rank, song_id, format_version(versions.get(playlist_id, 0) + 1), computed_at)
+            for playlist_id, ranked_song_ids in results
+            for rank, song_id in enumerate(ranked_song_ids)]
+    cur.executemany('DELETE FROM playlist_recommendation WHERE playlist_id = ?', [(playlist_id,) for playlist_id in playlist_ids])
+    cur.executemany(
+        'INSERT INTO playlist_recommendation (playlist_id, rank, song_id, version, computed_at) VALUES (?, ?, ?, ?, ?)', rows)
+    # Pages showing these playlists' suggestions are out of date once new ones are written
+    for playlist_id in playlist_ids:
+        bump_playlist_version(cur, playlist_id)
+    conn.commit()
+    cur.close()
+    conn.close()
+    finished = time.perf_counter()
+
+    click.echo(f'Loaded {len(playlist_ids)} libraries in {loaded - started:.2f}s.')
+    click.echo(f'Scored {len(results)} playlists in {scored - loaded:.2f}s '
+               f'({len(results) / max(scored - loaded, 1e-9):.1f} playlists/sec).')
+    click.echo(f'Wrote {len(rows)} suggestions in {finished - scored:.2f}s, '
+               f'{len(results) / max(finished - started, 1e-9):.1f} playlists/sec overall.')
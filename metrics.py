@@ -0,0 +1,277 @@
+"""
+metrics.py
+
+This file defines the instrumentation of requests.
+It includes counters and histograms of request time, SQL queries, named spans, and template
+rendering, a connection class that times every query run through it, hooks that attribute the
+measurements to the request being served and add a Server-Timing header to its response, a /metrics
+endpoint in the Prometheus text format, and an opt-in mode that profiles every Nth request with
+cProfile and saves the profile to disk.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import bisect
+import contextvars
+import cProfile
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import request, Response
+from flask.signals import before_render_template, template_rendered
+
+# Upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counter of values by label values
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    # Function to write the counter in the Prometheus text format
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+        return lines
+
+# Histogram of observed values by label values, with cumulative buckets
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # One count per bucket plus the overflow bucket, then the sum
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    # Function to write the histogram in the Prometheus text format
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, counts in sorted(self.values.items()):
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    total += count
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), label_values + (str(bound),))} {total}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, label_values)} {counts[-1]}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, label_values)} {total}')
+        return lines
+
+# Function to format label names and values, escaping the values
+def format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+# Metrics of this worker, requests not served by a view and work outside requests are labelled 'background'
+REQUESTS = Counter('harmonyvault_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+REQUEST_DURATION = Histogram('harmonyvault_request_duration_seconds', 'Wall time of requests.', ('endpoint',))
+SQL_QUERIES = Counter('harmonyvault_sql_queries_total', 'SQL statements run.', ('endpoint',))
+SQL_DURATION = Counter('harmonyvault_sql_duration_seconds_total', 'Time spent running SQL statements and fetching their rows.', ('endpoint',))
+REQUEST_SQL_QUERIES = Histogram('harmonyvault_request_sql_queries', 'SQL statements run per request.', ('endpoint',),
+                                (1, 2, 5, 10, 20, 50, 100, 200, 500))
+SPAN_DURATION = Histogram('harmonyvault_span_duration_seconds', 'Wall time of named stages.', ('span',))
+TEMPLATE_DURATION = Histogram('harmonyvault_template_render_seconds', 'Time spent rendering templates.', ('template',))
+PROFILES = Counter('harmonyvault_profiles_total', 'Requests profiled.', ('endpoint',))
+METRICS = [REQUESTS, REQUEST_DURATION, SQL_QUERIES, SQL_DURATION, REQUEST_SQL_QUERIES, SPAN_DURATION, TEMPLATE_DURATION, PROFILES]
+
+# Measurements of one request
+class RequestMetrics:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.status = None
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.spans = {}
+        self.templates = []
+        self.profile = None
+
+# Measurements of the request being served in this context, None outside requests
+current_metrics = contextvars.ContextVar('current_metrics', default=None)
+
+# Function to attribute SQL time to the current request
+def record_sql(seconds, queries=1):
+    metrics = current_metrics.get()
+    endpoint = metrics.endpoint if metrics else 'background'
+    if metrics:
+        metrics.sql_queries += queries
+        metrics.sql_seconds += seconds
+    if queries:
+        SQL_QUERIES.inc((endpoint,), queries)
+    SQL_DURATION.inc((endpoint,), seconds)
+
+# Function to time a named stage of the current request, such as a recommender step
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        SPAN_DURATION.observe((name,), seconds)
+        metrics = current_metrics.get()
+        if metrics:
+            metrics.spans[name] = metrics.spans.get(name, 0.0) + seconds
+
+# Cursor that times its statements and row fetches
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record_sql(time.perf_counter() - started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record_sql(time.perf_counter() - started)
+
+    def executescript(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            record_sql(time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record_sql(time.perf_counter() - started, 0)
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            record_sql(time.perf_counter() - started, 0)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_sql(time.perf_counter() - started, 0)
+
+# Connection whose cursors, including those of its execute shortcuts, time their statements
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+# Function to start measuring a request, and profiling it if it is the Nth
+def start_request(app):
+    metrics = RequestMetrics(request.endpoint or 'unmatched')
+    metrics.token = current_metrics.set(metrics)
+    every = app.config['PROFILE_EVERY']
+    if every and request.endpoint != 'metrics' and next(app.extensions['metrics']['requests']) % every == 0:
+        # Only one request is profiled at a time, a due request is skipped while another is being profiled
+        if app.extensions['metrics']['profile_lock'].acquire(blocking=False):
+            metrics.profile = cProfile.Profile()
+            metrics.profile.enable()
+
+# Function to record a response's status, and report the request's SQL and render time in its Server-Timing header
+def finish_response(response):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return response
+    metrics.status = response.status_code
+    timings = [f'total;dur={(time.perf_counter() - metrics.started) * 1000:.1f}',
+               f'sql;dur={metrics.sql_seconds * 1000:.1f};desc="{metrics.sql_queries} queries"']
+    timings.extend(f'{name.replace(".", "-")};dur={seconds * 1000:.1f}' for name, seconds in metrics.spans.items())
+    if metrics.templates:
+        timings.append(f'render;dur={sum(seconds for _, seconds in metrics.templates) * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+# Function to record a finished request, saving its profile if it was profiled
+def finish_request(app, exception=None):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return
+    current_metrics.reset(metrics.token)
+    seconds = time.perf_counter() - metrics.started
+    status = metrics.status or (500 if exception else 200)
+    REQUESTS.inc((metrics.endpoint, request.method, str(status)))
+    REQUEST_DURATION.observe((metrics.endpoint,), seconds)
+    REQUEST_SQL_QUERIES.observe((metrics.endpoint,), metrics.sql_queries)
+    if metrics.profile is not None:
+        metrics.profile.disable()
+        app.extensions['metrics']['profile_lock'].release()
+        directory = app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        metrics.profile.dump_stats(os.path.join(
+            directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{metrics.endpoint}-{int(seconds * 1000)}ms.prof'))
+        PROFILES.inc((metrics.endpoint,))
+
+# Function to note when a template starts rendering
+def start_template(sender, template, context, **extra):
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.template_started = time.perf_counter()
+
+# Function to record how long a template took to render
+def finish_template(sender, template, context, **extra):
+    metrics = current_metrics.get()
+    started = getattr(metrics, 'template_started', None)
+    if started is None:
+        return
+    metrics.template_started = None
+    seconds = time.perf_counter() - started
+    metrics.templates.append((template.name, seconds))
+    TEMPLATE_DURATION.observe((template.name,), seconds)
+
+# Route to expose this worker's metrics in the Prometheus text format
+def metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# Function to register the request hooks, template signals, and /metrics endpoint
+def init_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.extensions['metrics'] = {'requests': itertools.count(1), 'profile_lock': threading.Lock()}
+    app.before_request(lambda: start_request(app))
+    app.after_request(finish_response)
+    app.teardown_request(lambda exception=None: finish_request(app, exception))
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(finish_template, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,302 @@
+"""
+migrations.py
+
+This file defines the versioned migrations that bring a database up to the schema the application
+expects. It includes the ordered list of migrations, a runner that applies the pending ones at
+startup or from the CLI and records each applied version in the schema_version table, and a CLI
+command that checks the query plans of the request handlers' queries and of the triggers for full table scans.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import ast
+import importlib
+import os
+import re
+import sqlite3
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .schema import TABLES, INDEXES, SONG_DATA_LINK, SONG_DATA_TRIGGERS, SESSION_TABLES, PLAYLIST_POSITION_FILL, \
+    PLAYLIST_POSITION, VERSION_TABLES, SONG_REFERENCE_INDEXES, PLAYLIST_SONGS_SONG_ID, table_exists, init_search_index
+
+# Table recording the migrations applied to the database
+SCHEMA_VERSION_TABLE = '''CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at REAL NOT NULL
+)'''
+
+# Function to add the tables the application keeps on top of the catalogue
+def add_app_tables(cur):
+    for statement in TABLES:
+        cur.execute(statement)
+    cur.execute('INSERT OR IGNORE INTO catalogue_generation (id, generation) VALUES (1, 0)')
+
+# Function to add the full-text search index, skipped until there is a catalogue to index
+def add_search_index(cur):
+    if not table_exists(cur, 'song'):
+        return False
+    init_search_index(cur)
+
+# Function to index the hot query paths, dropping duplicate playlist entries so membership can be unique
+def add_hot_path_indexes(cur):
+    if not all(table_exists(cur, name) for name in ['playlist', 'playlist_songs', 'song', 'song_data', 'user']):
+        return False
+    duplicated = 'SELECT playlist_id FROM playlist_songs GROUP BY playlist_id, song_id HAVING COUNT(*) > 1'
+    # Taste vectors counted the duplicates, they are recomputed on next use
+    cur.execute(f'DELETE FROM playlist_taste WHERE playlist_id IN ({duplicated})')
+    cur.execute('DELETE FROM playlist_songs WHERE rowid NOT IN (SELECT MIN(rowid) FROM playlist_songs GROUP BY playlist_id, song_id)')
+    for statement in INDEXES:
+        cur.execute(statement)
+
+# Function to link every song_data row to its song, so features and suggestions join on song_id instead of title
+def add_song_data_song_id(cur):
+    if not all(table_exists(cur, name) for name in ['song', 'song_data', 'artist']):
+        return False
+    if 'song_id' not in [row[1] for row in cur.execute('PRAGMA table_info(song_data)').fetchall()]:
+        cur.execute('ALTER TABLE song_data ADD COLUMN song_id INTEGER')
+    cur.execute(SONG_DATA_LINK)
+    cur.execute('CREATE INDEX IF NOT EXISTS song_data_song_id ON song_data (song_id)')
+    for statement in SONG_DATA_TRIGGERS:
+        cur.execute(statement)
+    # Taste vectors were summed over title matches, they are recomputed on next use
+    cur.execute('DELETE FROM playlist_taste')
+
+# Function to add the table of server-side sessions
+def add_session_table(cur):
+    for statement in SESSION_TABLES:
+        cur.execute(statement)
+
+# Function to give playlist songs an order, numbering existing songs in the order they were added
+def add_playlist_position(cur):
+    if not table_exists(cur, 'playlist_songs'):
+        return False
+    if 'position' not in [row[1] for row in cur.execute('PRAGMA table_info(playlist_songs)').fetchall()]:
+        cur.execute('ALTER TABLE playlist_songs ADD COLUMN position INTEGER')
+    cur.execute(PLAYLIST_POSITION_FILL)
+    for statement in PLAYLIST_POSITION:
+        cur.execute(statement)
+
+# Function to add the version counters of playlist and user pages, and the time of the last catalogue edit
+def add_page_versions(cur):
+    for statement in VERSION_TABLES:
+        cur.execute(statement)
+    if 'modified' not in [row[1] for row in cur.execute('PRAGMA table_info(catalogue_generation)').fetchall()]:
+        cur.execute('ALTER TABLE catalogue_generation ADD COLUMN modified REAL')
+    cur.execute('UPDATE catalogue_generation SET modified = COALESCE(modified, ?)', (time.time(),))
+
+# Function to index songs by album and artist, so edits to an album or artist find its songs without a scan
+def add_song_reference_indexes(cur):
+    if not table_exists(cur, 'song'):
+        return False
+    for statement in SONG_REFERENCE_INDEXES:
+        cur.execute(statement)
+
+# Function to recreate the song_data triggers so song edits also drop the taste vectors their relinked rows change
+def add_song_data_taste_reset(cur):
+    if not all(table_exists(cur, name) for name in ['song', 'song_data', 'artist', 'playlist_songs']):
+        return False
+    cur.execute(PLAYLIST_SONGS_SONG_ID)
+    cur.execute('DROP TRIGGER IF EXISTS song_data_link_update')
+    cur.execute('DROP TRIGGER IF EXISTS song_data_link_delete')
+    for statement in SONG_DATA_TRIGGERS:
+        cur.execute(statement)
+    # Earlier song edits may have left taste vectors out of date, they are recomputed on next use
+    cur.execute('DELETE FROM playlist_taste')
+
+# Migrations in the order they are applied, a migration returning False needs tables that are not there yet, so it is
+# left unrecorded and tried again by later runs while the migrations after it still apply
+MIGRATIONS = [
+    (1, 'Add playlist taste, precomputed suggestion, catalogue generation, and search cache tables', add_app_tables),
+    (2, 'Add the full-text search index and its triggers', add_search_index),
+    (3, 'Index the hot query paths and make playlist membership unique', add_hot_path_indexes),
+    (4, 'Link song_data rows to songs by song_id', add_song_data_song_id),
+    (5, 'Add the server-side session table', add_session_table),
+    (6, 'Order playlist songs by a position column', add_playlist_position),
+    (7, 'Add version counters of playlist and user pages', add_page_versions),
+    (8, 'Index songs by album and artist', add_song_reference_indexes),
+    (9, 'Drop the taste vectors of playlists whose songs an edit relinks', add_song_data_taste_reset),
+]
+
+# Function to get the migrations applied to a database
+def get_applied_versions(cur):
+    cur.execute(SCHEMA_VERSION_TABLE)
+    return {row[0] for row in cur.execute('SELECT version FROM schema_version').fetchall()}
+
+# Seconds a worker waits for the write lock while another worker applies a migration
+MIGRATION_TIMEOUT = 60
+
+# Function to apply the pending migrations up to a version, each in its own transaction, returning those applied.
+# Workers starting together may all call it, so each migration takes the write lock and reads the applied ones again first
+def migrate(database, target=None, timeout=MIGRATION_TIMEOUT):
+    conn = sqlite3.connect(database, timeout=timeout)
+    cur = conn.cursor()
+    applied = []
+    try:
+        versions = get_applied_versions(cur)
+        conn.commit()
+        for number, description, apply in MIGRATIONS:
+            if number in versions:
+                continue
+            if target is not None and number > target:
+                break
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                if number in get_applied_versions(cur):
+                    # Another worker applied it while this one waited for the lock
+                    conn.rollback()
+                    continue
+                if apply(cur) is False:
+                    conn.rollback()
+                    continue
+                cur.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                            (number, description, time.time()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append((number, description))
+    finally:
+        cur.close()
+        conn.close()
+    return applied
+
+# CLI command to apply the pending migrations
+@click.command('migrate')
+@click.option('--to', 'target', type=int, default=None, help='Last migration to apply, defaults to all of them.')
+@with_appcontext
+def migrate_command(target):
+    applied = migrate(current_app.config['DATABASE'], target)
+    for number, description in applied:
+        click.echo(f'Applied migration {number}: {description}')
+    conn = sqlite3.connect(current_app.config['DATABASE'])
+    versions = get_applied_versions(conn.cursor())
+    conn.close()
+    for number, description, _ in MIGRATIONS:
+        if number not in versions:
+            click.echo(f'Pending migration {number}: {description}')
+    click.echo(f'Database has {len(versions)} of {len(MIGRATIONS)} migrations applied.')
+
+# Modules whose query literals are checked, with the functions to check or None for every query in the module
+CHECKED_QUERIES = {
+    'views.py': None,
+    'auth.py': None,
+    'recommender.py': ['get_playlist_version', 'recommend_song_ids_by_audio', 'get_songs', 'recommend_songs'],
+    'jobs.py': ['read_recommendations'],
+    'search.py': ['iter_search_songs', 'get_cached_search', 'set_cached_search'],
+    'catalogue.py': ['refresh', 'load_missing'],
+    'taste.py': ['get_song_features', 'get_songs_features', 'compute_taste', 'get_taste', 'update_taste',
+                 'update_taste_batch'],
+}
+
+# Module-level constants holding the queries the checked functions build from parts, a query or a dict of queries each
+CHECKED_CONSTANTS = {
+    'search': ['SEARCH_QUERIES'],
+    'catalogue': ['RECORD_QUERIES', 'LISTED_RECORDS_QUERIES'],
+    'taste': ['SONG_FEATURES_QUERY', 'LISTED_SONGS_FEATURES_QUERY', 'PLAYLIST_FEATURES_QUERY'],
+}
+
+# Plan steps that read a table or one of its indexes from start to end, or a virtual table without a constraint
+SCAN_STEP = re.compile(r'^SCAN (\w+)(?: VIRTUAL TABLE INDEX (\d+):(\S*)| (USING (?:COVERING )?INDEX) \w+)?')
+
+# Queries that end with a limit, which stop an index walk in the order they sort by once the limit is reached
+LIMITED = re.compile(r'\bLIMIT \?\s*$')
+
+# Columns of the row that fired a trigger, planned as parameters
+TRIGGER_ROW_COLUMN = re.compile(r'\b(?:NEW|OLD)\.\w+')
+
+# Function to get the table a plan step reads in full, None if the step only looks rows up. An index walk is only
+# accepted when it gives the order of a limited query, so it stops after the rows it returns
+def get_scanned_table(detail, ordered_limit=False):
+    match = SCAN_STEP.match(detail)
+    if match is None or match.group(1) == 'CONSTANT':
+        return None
+    if match.group(2) is not None and (match.group(2) != '0' or match.group(3)):
+        # A virtual table given a constraint, such as an FTS5 match or rowid, or the array of json_each
+        return None
+    if match.group(4) and ordered_limit:
+        return None
+    return match.group(1)
+
+# Function to find the query literals passed to execute in a module, with their line numbers.
+# Queries built with an f-string are returned as None, they are planned from their module-level constants instead
+def find_queries(path, functions=None):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    scopes = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef) and node.name in functions] \
+        if functions else [tree]
+    queries = []
+    for scope in scopes:
+        for node in ast.walk(scope):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                    and node.func.attr in ('execute', 'executemany') and node.args:
+                argument = node.args[0]
+                if isinstance(argument, ast.JoinedStr):
+                    queries.append((node.lineno, None))
+                elif isinstance(argument, ast.Constant) and isinstance(argument.value, str) \
+                        and argument.value.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE'):
+                    queries.append((node.lineno, argument.value))
+    return sorted(set(queries), key=lambda query: query[0])
+
+# Function to get the queries held by the checked module-level constants, labelled by constant
+def get_constant_queries():
+    queries = []
+    for module, names in CHECKED_CONSTANTS.items():
+        imported = importlib.import_module(f'.{module}', __package__)
+        for name in names:
+            value = getattr(imported, name)
+            if isinstance(value, dict):
+                queries.extend((f'{module}.{name}[{key!r}]', query) for key, query in value.items())
+            else:
+                queries.append((f'{module}.{name}', value))
+    return queries
+
+# Function to get the statements of every trigger in the database, with the triggering row's columns as parameters
+def get_trigger_queries(cur):
+    queries = []
+    for name, sql in cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name").fetchall():
+        body = sql[sql.upper().index('BEGIN') + len('BEGIN'):sql.upper().rindex('END')]
+        statements = [statement.strip() for statement in TRIGGER_ROW_COLUMN.sub('?', body).split(';')]
+        queries.extend((f'trigger {name}', statement) for statement in statements if statement)
+    return queries
+
+# CLI command to fail if a request handler's query or a trigger's statement reads a whole table
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    conn = sqlite3.connect(current_app.config['DATABASE'])
+    cur = conn.cursor()
+    package = os.path.dirname(os.path.abspath(__file__))
+    queries = []
+    for module, functions in CHECKED_QUERIES.items():
+        queries.extend((f'{module}:{line}', query) for line, query in find_queries(os.path.join(package, module), functions))
+    queries.extend(get_constant_queries())
+    queries.extend(get_trigger_queries(cur))
+
+    scans, unchecked = [], []
+    for label, query in queries:
+        if query is None:
+            unchecked.append(f'{label} builds its query with an f-string, keep it in a checked module-level constant')
+            continue
+        try:
+            plan = cur.execute(f'EXPLAIN QUERY PLAN {query}', [None] * query.count('?')).fetchall()
+        except sqlite3.Error as e:
+            unchecked.append(f'{label} {e}')
+            continue
+        ordered_limit = LIMITED.search(query) is not None and not any('TEMP B-TREE FOR ORDER BY' in row[-1] for row in plan)
+        tables = [table for table in (get_scanned_table(row[-1], ordered_limit) for row in plan) if table]
+        click.echo(f'{label} {"SCAN " + ", ".join(tables) if tables else "ok"}')
+        if tables:
+            scans.append(f'{label} scans {", ".join(tables)}')
+    cur.close()
+    conn.close()
+
+    for message in unchecked:
+        click.echo(f'Could not plan {message}')
+    if scans or unchecked:
+        raise click.ClickException('\n'.join(
+            (['Full table scans in hot queries:'] + scans if scans else []) +
+            (['Hot queries that could not be planned:'] + unchecked if unchecked else [])))
+    click.echo('No hot query or trigger scans a whole table.')
@@ -0,0 +1,408 @@
+"""
+recommender.py
+
+This file defines the song recommendation model used by the views blueprint.
+It includes functions to build the model from the song_data table, save it to disk next to the
+database, load it once per worker process, and score playlists against the loaded model, either
+by TF-IDF similarity or through a nearest-neighbour index over the numeric audio features, which
+are kept in a memory-mapped feature store shared by every worker.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import os
+import json
+import pickle
+import threading
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .metrics import span
+from .catalogue import catalogue_dimensions
+
+# Set the database filename
+DATABASE = 'HarmonyVault.db'
+
+# Version of the saved model format, bump whenever the model contents change
+MODEL_VERSION = 7
+
+# List of features to train model on
+FEATURES = ['popularity', 'danceability', 'energy', 'loudness', 'speechiness',
+            'acousticness', 'instrumentalness', 'liveness', 'valence']
+
+# Model loaded by this worker process, shared by every request it serves, and the file it was loaded from
+_model = None
+_model_key = None
+_model_lock = threading.Lock()
+
+# Function to get the path of the saved model file next to the database
+def get_model_path(database=DATABASE):
+    root, _ = os.path.splitext(database)
+    return f'{root}.recommender.v{MODEL_VERSION}.pkl'
+
+# Function to get the path of the feature store file next to the database
+def get_feature_store_path(database=DATABASE):
+    root, _ = os.path.splitext(database)
+    return f'{root}.features.v{MODEL_VERSION}.bin'
+
+# Function to load the audio features straight into a contiguous float32 array, one row per song, with the song id
+# each row is linked to, or -1 for rows not linked to a song
+def load_features(database=DATABASE):
+    import sqlite3
+    import itertools
+    import numpy as np
+
+    conn = sqlite3.connect(database)
+    cur = conn.cursor()
+    ids = np.fromiter((row[0] for row in cur.execute('SELECT COALESCE(song_id, -1) FROM song_data ORDER BY rowid')),
+                      dtype=np.int64)
+    cur.execute(f'SELECT {", ".join(FEATURES)} FROM song_data ORDER BY rowid')
+    values = np.fromiter(itertools.chain.from_iterable(cur), dtype=np.float32,
+                         count=len(ids) * len(FEATURES))
+    cur.close()
+    conn.close()
+    return ids, values.reshape(len(ids), len(FEATURES))
+
+# Function to standardize the features, and scale each row to unit length for cosine similarity
+def standardize_features(values, metric='euclidean'):
+    import numpy as np
+
+    mean = values.mean(axis=0, dtype=np.float64)
+    std = values.std(axis=0, dtype=np.float64)
+    std[std == 0] = 1
+    features = ((values - mean) / std).astype(np.float32)
+    if metric == 'cosine':
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        features /= norms
+    return np.ascontiguousarray(features), mean, std
+
+# Function to write the numeric feature vectors of every song and their index to the feature store
+def build_feature_store(database=DATABASE, index='exact', lists=None, metric='euclidean'):
+    from .ann import build_index
+    from .feature_store import write_feature_store
+
+    ids, values = load_features(database)
+    features, mean, std = standardize_features(values, metric)
+    path = get_feature_store_path(database)
+    write_feature_store(path, features, ids, mean, std, metric, build_index(index, features, lists=lists))
+    return path
+
+# Function to open the feature store shared by every worker, building it if the build step has not been run yet
+def load_feature_store(database=DATABASE):
+    from .feature_store import get_feature_store
+
+    path = get_feature_store_path(database)
+    if not os.path.exists(path):
+        with _model_lock:
+            if not os.path.exists(path):
+                build_feature_store(database, index=current_app.config['RECOMMENDER_INDEX'],
+                                    lists=current_app.config['RECOMMENDER_LISTS'],
+                                    metric=current_app.config['RECOMMENDER_METRIC'])
+    return get_feature_store(path, current_app.config['RECOMMENDER_PROBES'])
+
+# Function to fit the model on the song_data table
+def build_model(database=DATABASE):
+    # Import necessary modules
+    import sqlite3
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    # Load table into dataframe
+    with span('recommender.load_data'):
+        conn = sqlite3.connect(database)
+        query = '''SELECT song_id, title, popularity, danceability, energy, loudness, speechiness, acousticness,
+                    instrumentalness, liveness, valence FROM song_data'''
+        music_data = pd.read_sql_query(query, conn)
+        conn.close()
+
+        music_data['combined_features'] = music_data.apply(
+            lambda row: ' '.join([str(row[feature]) for feature in FEATURES]), axis=1)
+
+    # Split data into training and testing sets
+    train_data, test_data = train_test_split(
+        music_data, test_size=0.2, random_state=42)
+
+    train_data.reset_index(drop=True, inplace=True)
+
+    with span('recommender.tfidf_fit'):
+        tfidf_vectorizer = TfidfVectorizer()
+        tfidf_matrix = tfidf_vectorizer.fit_transform(
+            train_data['combined_features'])
+
+    # Map each song to every row linked to it, rows without a song have id -1
+    song_ids = train_data['song_id'].fillna(-1).astype('int64').tolist()
+    song_index = {}
+    for row, song_id in enumerate(song_ids):
+        if song_id >= 0:
+            song_index.setdefault(song_id, []).append(row)
+
+    return {
+        'version': MODEL_VERSION,
+        'titles': train_data['title'].tolist(),
+        'song_ids': song_ids,
+        'song_index': song_index,
+        'matrix': tfidf_matrix.tocsr(),
+    }
+
+# Function to save the model, replacing any previous file atomically. The file is written under a name of this
+# process, so processes building the model at once never write to or move each other's file
+def save_model(model, path):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+# Function to identify a saved model file, so a file replaced by `flask build-model` is told apart, None if there is none
+def get_model_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Function to load the model once per worker process, loading it again if the file was replaced since
+def load_model(database=DATABASE):
+    global _model, _model_key
+    path = get_model_path(database)
+    if _model is not None and get_model_key(path) == _model_key:
+        return _model
+    with _model_lock:
+        key = get_model_key(path)
+        if _model is None or key != _model_key:
+            model = None
+            if key is not None:
+                with open(path, 'rb') as f:
+                    model = pickle.load(f)
+            # Fit the model here only if the build step has not been run yet
+            if not model or model.get('version') != MODEL_VERSION:
+                model = build_model(database)
+                save_model(model, path)
+                key = get_model_key(path)
+            _model = model
+            _model_key = key
+    return _model
+
+# Function to drop the loaded model so the next request reloads it from disk
+def reset_model():
+    global _model, _model_key
+    with _model_lock:
+        _model = None
+        _model_key = None
+
+# Function to get the model rows of all input songs
+def get_song_indices(model, song_ids):
+    song_indices = []
+    for song_id in song_ids:
+        song_indices.extend(model['song_index'].get(song_id, []))
+    return song_indices
+
+# Function to rank song ids by score, skipping the best match, rows without a song, and repeated songs
+def rank_song_ids(model, scores, count=10):
+    # The best match is skipped, as it is the input song itself
+    k = count + 1
+    while True:
+        ranked = dict.fromkeys(model['song_ids'][i] for i in top_k(scores, k)[1:])
+        song_ids = [song_id for song_id in ranked if song_id >= 0]
+        if len(song_ids) >= count or k >= len(scores):
+            return song_ids[:count]
+        k *= 2
+
+# Function to score every song against the aggregate of the input rows
+def score_songs(model, song_indices):
+    import numpy as np
+
+    matrix = model['matrix']
+    if not song_indices:
+        return np.zeros(matrix.shape[0])
+
+    # Summing the input rows first turns the aggregate into one matrix-vector product
+    query = np.asarray(matrix[song_indices].sum(axis=0)).ravel()
+    return matrix.dot(query)
+
+# Function to select the indices of the k highest scores without sorting the catalogue
+def top_k(scores, k):
+    import numpy as np
+
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # Keep every score tied with the k-th best so ties resolve in index order, like a stable sort
+    threshold = np.partition(scores, n - k)[n - k]
+    candidates = np.flatnonzero(scores >= threshold)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+# Function to rank the ids of songs whose audio features are closest to a playlist's taste vector
+def recommend_song_ids_by_audio(store, cur, playlist_id, count=10, probes=None):
+    import numpy as np
+    from .taste import get_taste
+
+    # The average of the playlist's raw features, standardized like the stored rows
+    song_count, feature_sum = get_taste(cur, playlist_id)
+    if song_count:
+        query = ((feature_sum / song_count - store.mean) / store.std).astype(np.float32)
+    else:
+        query = np.zeros(store.features.shape[1], dtype=np.float32)
+    if store.metric == 'cosine':
+        norm = np.linalg.norm(query)
+        if norm:
+            query /= norm
+
+    # Ask for extra neighbours so the playlist's own songs can be left out, widening the search if too many were
+    in_playlist = {row[0] for row in cur.execute(
+        'SELECT song_id FROM playlist_songs WHERE playlist_id = ?', (playlist_id,)).fetchall()}
+    k = count * 2
+    while True:
+        neighbour_rows = store.index.search(query, k, probes=probes)
+        songs = [song_id for song_id in dict.fromkeys(store.ids[neighbour_rows].tolist())
+                 if song_id >= 0 and song_id not in in_playlist][:count]
+        # Fewer rows than asked for means the probed partitions hold no more songs
+        if len(songs) >= count or len(neighbour_rows) < k or k >= len(store.ids):
+            return songs
+        k *= 4
+
+# Function to rank the ids of songs similar to the given songs
+def recommend_song_ids(model, song_ids, count=10):
+    with span('recommender.similarity'):
+        scores = score_songs(model, get_song_indices(model, song_ids))
+    with span('recommender.rank'):
+        return rank_song_ids(model, scores, count)
+
+# Function to get song rows with artist name, album title, and album image, in the order of the given ids
+def get_songs(cur, song_ids):
+    with span('recommender.fetch_songs'):
+        return catalogue_dimensions.resolve(cur, cur.execute(
+            'SELECT song.* FROM json_each(?) AS ranked CROSS JOIN song ON song.song_id = ranked.value ORDER BY ranked.key',
+            (json.dumps(song_ids),)).fetchall())
+
+# Function to get a playlist's version counter, bumped by every edit to its songs and by every write of its suggestions
+def get_playlist_version(cur, playlist_id):
+    row = cur.execute("SELECT version FROM content_version WHERE kind = 'playlist' AND id = ?", (playlist_id,)).fetchone()
+    return row[0] if row else 0
+
+# Function to generate suggested song rows for a playlist with the configured recommender mode
+def recommend_songs(cur, playlist_id, database=DATABASE):
+    # Audio mode only needs the playlist's taste vector
+    if current_app.config['RECOMMENDER_MODE'] == 'audio':
+        with span('recommender.load_feature_store'):
+            store = load_feature_store(database)
+        with span('recommender.nearest_neighbours'):
+            song_ids = recommend_song_ids_by_audio(store, cur, playlist_id,
+                                                   probes=current_app.config['RECOMMENDER_PROBES'])
+    else:
+        # Retrieve the playlist's songs from database
+        playlist_song_ids = [row[0] for row in cur.execute(
+            'SELECT song_id FROM playlist_songs WHERE playlist_id = ?', (playlist_id,)).fetchall()]
+        with span('recommender.load_model'):
+            model = load_model(database)
+        song_ids = recommend_song_ids(model, playlist_song_ids)
+
+    return get_songs(cur, song_ids)
+
+# Function to rank songs the way the original dense similarity matrix did, used to check the engine
+def reference_indices(model, song_indices, count=10):
+    from sklearn.metrics.pairwise import linear_kernel
+
+    matrix = model['matrix']
+    aggregate_sim_scores = [0] * matrix.shape[0]
+    if song_indices:
+        for sim_row in linear_kernel(matrix[song_indices], matrix):
+            aggregate_sim_scores = [
+                x + y for x, y in zip(aggregate_sim_scores, sim_row)]
+
+    sim_scores = list(enumerate(aggregate_sim_scores))
+    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+    return [i[0] for i in sim_scores[1:count + 1]]
+
+# CLI command to fit the model and save it next to the database
+@click.command('build-model')
+@click.option('--index', type=click.Choice(['exact', 'ivf']), default=None,
+              help='Nearest-neighbour index for audio mode, defaults to RECOMMENDER_INDEX.')
+@click.option('--lists', type=int, default=None,
+              help='Number of k-means partitions for the ivf index, defaults to sqrt(songs).')
+@click.option('--metric', type=click.Choice(['euclidean', 'cosine']), default=None,
+              help='Similarity used in audio mode, defaults to RECOMMENDER_METRIC.')
+@with_appcontext
+def build_model_command(index, lists, metric):
+    from .feature_store import get_feature_store
+
+    database = current_app.config['DATABASE']
+    path = get_model_path(database)
+    model = build_model(database)
+    save_model(model, path)
+    reset_model()
+    click.echo(f'Saved recommendation model for {len(model["titles"])} songs to {path}.')
+
+    # Workers notice the replaced file on their next request and map the new one
+    store_path = build_feature_store(database, index=index or current_app.config['RECOMMENDER_INDEX'],
+                                     lists=lists or current_app.config['RECOMMENDER_LISTS'],
+                                     metric=metric or current_app.config['RECOMMENDER_METRIC'])
+    features = get_feature_store(store_path).features
+    click.echo(f'Saved feature store for {len(features)} songs to {store_path}, '
+               f'{features.nbytes // max(1, len(features))} bytes per song.')
+
+    # Recompute the playlists' taste vectors from the current catalogue
+    import sqlite3
+    from .taste import rebuild_tastes
+    conn = sqlite3.connect(database)
+    click.echo(f'Rebuilt taste vectors for {rebuild_tastes(conn)} playlists.')
+    conn.close()
+
+# CLI command to check the scoring engine against the original ranking for every playlist
+@click.command('check-model')
+@with_appcontext
+def check_model_command():
+    import sqlite3
+    import numpy as np
+
+    database = current_app.config['DATABASE']
+    model = load_model(database)
+    conn = sqlite3.connect(database)
+    cur = conn.cursor()
+    playlist_ids = [row[0] for row in cur.execute('SELECT playlist_id FROM playlist').fetchall()]
+
+    identical, tie_order, mismatched = 0, 0, []
+    for playlist_id in playlist_ids:
+        song_ids = [row[0] for row in cur.execute(
+            'SELECT song_id FROM playlist_songs WHERE playlist_id = ?', (playlist_id,)).fetchall()]
+        song_indices = get_song_indices(model, song_ids)
+        scores = score_songs(model, song_indices)
+        expected = reference_indices(model, song_indices)
+        actual = list(top_k(scores, len(expected) + 1)[1:])
+        if actual == expected:
+            identical += 1
+        elif np.allclose(scores[actual], scores[expected], rtol=1e-9, atol=1e-12):
+            # Only scores equal up to floating point summation order were swapped
+            tie_order += 1
+        else:
+            mismatched.append(playlist_id)
+    cur.close()
+    conn.close()
+
+    click.echo(f'{identical} identical, {tie_order} differing only in tie order, {len(mismatched)} mismatched.')
+    if mismatched:
+        raise click.ClickException(f'Rankings differ for playlists {mismatched}.')
+
+# CLI command to report recall@10 and latency of the ivf index against exact search
+@click.command('index-report')
+@click.option('--lists', type=int, default=None, help='Number of k-means partitions, defaults to sqrt(songs).')
+@click.option('--probes', default='1,2,4,8,16,32', help='Comma separated partition counts to scan per query.')
+@click.option('--queries', type=int, default=200, help='Number of songs used as queries.')
+@with_appcontext
+def index_report_command(lists, probes, queries):
+    from .ann import IVFIndex, recall_report
+
+    database = current_app.config['DATABASE']
+    index = load_feature_store(database).index
+    if index.kind != 'ivf' or lists:
+        index = IVFIndex(index.vectors, lists=lists)
+
+    click.echo(f'{len(index.vectors)} songs, {index.lists} partitions')
+    click.echo(f'{"probes":>8} {"recall@10":>10} {"ms/query":>10}')
+    for row in recall_report(index, [int(p) for p in probes.split(',')], queries=queries):
+        label = 'exact' if row['probes'] is None else row['probes']
+        click.echo(f'{label:>8} {row["recall"]:>10.3f} {row["latency_ms"]:>10.3f}')
@@ -0,0 +1,222 @@
+"""
+schema.py
+
+This file defines the tables the application adds on top of the original music and user tables,
+including the FTS5 full-text index used by search and the triggers that keep it in sync with the
+song, album, and artist tables, the song_id link from song_data to song, the catalogue generation
+number that catalogue edits bump, the server-side session table, the version counters of playlist
+and user pages, and the indexes on the hot query paths. They are applied in order by the migrations in migrations.py.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import time
+
+# Tables added on top of the original schema
+TABLES = [
+    # Running sum and count of the audio features of each playlist's songs
+    '''CREATE TABLE IF NOT EXISTS playlist_taste (
+        playlist_id INTEGER PRIMARY KEY,
+        song_count INTEGER NOT NULL,
+        feature_sum BLOB NOT NULL
+    )''',
+    # Suggested songs computed in the background for each playlist, in ranking order
+    '''CREATE TABLE IF NOT EXISTS playlist_recommendation (
+        playlist_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        song_id INTEGER NOT NULL,
+        version TEXT NOT NULL,
+        computed_at REAL NOT NULL,
+        PRIMARY KEY (playlist_id, rank)
+    )''',
+    # Catalogue generation number, bumped by every catalogue edit so cached catalogue data can be checked against it
+    '''CREATE TABLE IF NOT EXISTS catalogue_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )''',
+    # Search results shared by every worker process, tagged with the catalogue generation they were read from
+    '''CREATE TABLE IF NOT EXISTS search_cache (
+        key TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL,
+        results TEXT NOT NULL,
+        next_cursor TEXT,
+        created_at REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS search_cache_created_at ON search_cache (created_at)',
+]
+
+# Indexes on the columns the request handlers filter and join on
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS playlist_user_id ON playlist (user_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS playlist_songs_membership ON playlist_songs (playlist_id, song_id)',
+    'CREATE INDEX IF NOT EXISTS song_title ON song (title)',
+    'CREATE INDEX IF NOT EXISTS song_data_title ON song_data (title)',
+    'CREATE INDEX IF NOT EXISTS song_data_popularity ON song_data (popularity)',
+    'CREATE INDEX IF NOT EXISTS artist_name ON artist (name)',
+    'CREATE INDEX IF NOT EXISTS user_username ON user (username)',
+]
+
+# Indexes on the album and artist of each song, which the search index triggers look songs up by
+SONG_REFERENCE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS song_album_id ON song (album_id)',
+    'CREATE INDEX IF NOT EXISTS song_artist_id ON song (artist_id)',
+]
+
+# Server-side sessions, the session cookie only holds the id
+SESSION_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS user_session (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS user_session_expires ON user_session (expires)',
+]
+
+# Full-text index over song title, album title, and artist name, with rowid equal to song_id
+SEARCH_INDEX = '''CREATE VIRTUAL TABLE song_search USING fts5(
+    title, album_title, artist_name, prefix='2 3'
+)'''
+
+# Statement that copies songs into the search index, completed with a WHERE clause
+SEARCH_INDEX_ROWS = '''INSERT INTO song_search (rowid, title, album_title, artist_name)
+    SELECT song.song_id, song.title, album.title, artist.name FROM song
+    LEFT JOIN album ON song.album_id = album.album_id
+    LEFT JOIN artist ON song.artist_id = artist.artist_id'''
+
+# Triggers that keep the search index in sync with catalogue changes
+SEARCH_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS song_search_insert AFTER INSERT ON song BEGIN
+        {SEARCH_INDEX_ROWS} WHERE song.song_id = NEW.song_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS song_search_delete AFTER DELETE ON song BEGIN
+        DELETE FROM song_search WHERE rowid = OLD.song_id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_search_update AFTER UPDATE ON song BEGIN
+        DELETE FROM song_search WHERE rowid = OLD.song_id;
+        {SEARCH_INDEX_ROWS} WHERE song.song_id = NEW.song_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS song_search_album_update AFTER UPDATE OF title ON album BEGIN
+        UPDATE song_search SET album_title = NEW.title
+            WHERE rowid IN (SELECT song_id FROM song WHERE album_id = NEW.album_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS song_search_album_delete AFTER DELETE ON album BEGIN
+        UPDATE song_search SET album_title = NULL
+            WHERE rowid IN (SELECT song_id FROM song WHERE album_id = OLD.album_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS song_search_artist_update AFTER UPDATE OF name ON artist BEGIN
+        UPDATE song_search SET artist_name = NEW.name
+            WHERE rowid IN (SELECT song_id FROM song WHERE artist_id = NEW.artist_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS song_search_artist_delete AFTER DELETE ON artist BEGIN
+        UPDATE song_search SET artist_name = NULL
+            WHERE rowid IN (SELECT song_id FROM song WHERE artist_id = OLD.artist_id);
+    END''',
+]
+
+# Statement that links song_data rows to the song with the same title, preferring the same artist name,
+# completed with a WHERE clause
+SONG_DATA_LINK = '''UPDATE song_data SET song_id = COALESCE(
+    (SELECT MIN(song.song_id) FROM song JOIN artist ON song.artist_id = artist.artist_id
+        WHERE song.title = song_data.title AND artist.name = song_data.artist),
+    (SELECT MIN(song.song_id) FROM song WHERE song.title = song_data.title))'''
+
+# Statement that drops the taste vectors of playlists holding a song whose song_data rows were relinked, that is the
+# edited song and the songs titled like its old or new title, completed with the titles. They are recomputed on next use
+SONG_DATA_TASTE_RESET = '''DELETE FROM playlist_taste WHERE playlist_id IN (SELECT playlist_id FROM playlist_songs
+    WHERE song_id = OLD.song_id OR song_id IN (SELECT song_id FROM song_data WHERE title IN ({titles})))'''
+
+# Triggers that keep the song_data links in sync with songs being added, renamed, and removed, and drop the taste
+# vectors the relinked rows leave out of date. A new song is in no playlist yet, so no taste vector counts its rows
+SONG_DATA_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS song_data_link_insert AFTER INSERT ON song BEGIN
+        UPDATE song_data SET song_id = NEW.song_id WHERE song_id IS NULL AND title = NEW.title;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_data_link_update AFTER UPDATE OF title ON song BEGIN
+        {SONG_DATA_LINK} WHERE song_id = OLD.song_id OR (song_id IS NULL AND title = NEW.title);
+        {SONG_DATA_TASTE_RESET.format(titles='OLD.title, NEW.title')};
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS song_data_link_delete AFTER DELETE ON song BEGIN
+        {SONG_DATA_LINK} WHERE song_id = OLD.song_id;
+        {SONG_DATA_TASTE_RESET.format(titles='OLD.title')};
+    END''',
+]
+
+# Index on the song of each playlist entry, which the song_data triggers find the playlists holding a song by
+PLAYLIST_SONGS_SONG_ID = 'CREATE INDEX IF NOT EXISTS playlist_songs_song_id ON playlist_songs (song_id)'
+
+# Statement that numbers each playlist's songs from 0 in the order they were added
+PLAYLIST_POSITION_FILL = '''UPDATE playlist_songs SET position = numbered.position
+    FROM (SELECT rowid AS id, ROW_NUMBER() OVER (PARTITION BY playlist_id ORDER BY rowid) - 1 AS position
+        FROM playlist_songs) AS numbered
+    WHERE playlist_songs.rowid = numbered.id'''
+
+# Index and trigger that keep playlist songs in order, songs added without a position go to the end
+PLAYLIST_POSITION = [
+    'CREATE INDEX IF NOT EXISTS playlist_songs_position ON playlist_songs (playlist_id, position)',
+    '''CREATE TRIGGER IF NOT EXISTS playlist_songs_append AFTER INSERT ON playlist_songs WHEN NEW.position IS NULL BEGIN
+        UPDATE playlist_songs SET position = (
+            SELECT COALESCE(MAX(position), -1) + 1 FROM playlist_songs WHERE playlist_id = NEW.playlist_id)
+            WHERE rowid = NEW.rowid;
+    END''',
+]
+
+# Version counters of the pages built from a playlist or a user's playlists, bumped by every edit to them
+VERSION_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS content_version (
+        kind TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        modified REAL NOT NULL,
+        PRIMARY KEY (kind, id)
+    ) WITHOUT ROWID''',
+]
+
+# Function to check whether a table exists
+def table_exists(cur, name):
+    return cur.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+# Function to create the search index and its triggers, filling it from the catalogue on first creation
+def init_search_index(cur):
+    if not table_exists(cur, 'song'):
+        return
+    if not table_exists(cur, 'song_search'):
+        cur.execute(SEARCH_INDEX)
+        cur.execute(SEARCH_INDEX_ROWS)
+    for statement in SEARCH_TRIGGERS:
+        cur.execute(statement)
+
+# Function to refill the search index from the catalogue
+def rebuild_search_index(cur):
+    cur.execute('DELETE FROM song_search')
+    cur.execute(SEARCH_INDEX_ROWS)
+
+# Function to get the current catalogue generation
+def get_catalogue_generation(cur):
+    row = cur.execute('SELECT generation FROM catalogue_generation WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+# Function to start a new catalogue generation after a catalogue edit, in the edit's transaction
+def bump_catalogue_generation(cur):
+    cur.execute('UPDATE catalogue_generation SET generation = generation + 1, modified = ? WHERE id = 1', (time.time(),))
+    # Shared search results of older generations can never be served again
+    cur.execute('DELETE FROM search_cache WHERE generation < (SELECT generation FROM catalogue_generation WHERE id = 1)')
+
+# Function to bump the version of a user's pages, in the edit's transaction
+def bump_user_version(cur, user_id):
+    cur.execute('''INSERT INTO content_version (kind, id, version, modified) VALUES ('user', ?, 1, ?)
+        ON CONFLICT (kind, id) DO UPDATE SET version = version + 1, modified = excluded.modified''', (user_id, time.time()))
+
+# Function to bump the version of a playlist's page and of its owner's pages, in the edit's transaction
+def bump_playlist_version(cur, playlist_id):
+    modified = time.time()
+    cur.execute('''INSERT INTO content_version (kind, id, version, modified) VALUES ('playlist', ?, 1, ?)
+        ON CONFLICT (kind, id) DO UPDATE SET version = version + 1, modified = excluded.modified''', (playlist_id, modified))
+    cur.execute('''INSERT INTO content_version (kind, id, version, modified)
+        SELECT 'user', user_id, 1, ? FROM playlist WHERE playlist_id = ?
+        ON CONFLICT (kind, id) DO UPDATE SET version = version + 1, modified = excluded.modified''', (modified, playlist_id))
+
+# Function to get a page's version and when it last changed, with the catalogue generation it was built from
+def get_page_version(cur, kind, record_id):
+    return cur.execute(
+        'SELECT catalogue.generation, catalogue.modified, page.version, page.modified FROM catalogue_generation AS catalogue LEFT JOIN content_version AS page ON page.kind = ? AND page.id = ? WHERE catalogue.id = 1',
+        (kind, record_id)).fetchone()
@@ -0,0 +1,197 @@
+"""
+search.py
+
+This file defines the song search used by the views blueprint.
+It includes functions to turn a search query into an FTS5 prefix match over song title, album
+title, and artist name, run it against the song_search index ranked by BM25 one page at a time
+using keyset pagination, cache result pages in process and optionally in a table shared by every
+process, and a CLI command to rebuild the index.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import base64
+import json
+import sqlite3
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .cache import search_cache
+from .catalogue import catalogue_dimensions
+from .schema import get_catalogue_generation
+
+# Allowed result orders, the search form's values mapped to the sort column and direction
+ORDERS = {
+    'rank': ('bm25(song_search)', 'ASC'),
+    'song.title ASC': ('song.title', 'ASC'),
+    'song.title DESC': ('song.title', 'DESC'),
+    'song_id DESC': ('song.song_id', 'DESC'),
+}
+
+# Columns searched, a song matches when every token prefixes a word of one of them
+COLUMNS = ['title', 'album_title', 'artist_name']
+
+# Columns added to search result rows: album title, album image, and artist name
+SEARCH_FIELDS = (('album', 'title'), ('album', 'image_url'), ('artist', 'name'))
+
+# Rows read from the cursor at a time while streaming results
+FETCH_SIZE = 100
+
+# Query of a page of results, completed with the sort column, the seek past the previous page, and the order.
+# Songs whose album or artist was deleted are left out before the limit, so they never shorten a page
+SEARCH_QUERY = '''SELECT song.*, {column} FROM song_search
+    JOIN song ON song_search.rowid = song.song_id
+    WHERE song_search MATCH ? {seek}
+    AND EXISTS (SELECT 1 FROM album WHERE album.album_id = song.album_id)
+    AND EXISTS (SELECT 1 FROM artist WHERE artist.artist_id = song.artist_id)
+    ORDER BY {order_by}
+    LIMIT ?'''
+
+# Function to complete the search query for an order, from the first page or seeking past the last row of a page
+def build_search_query(order, after):
+    column, direction = ORDERS[order]
+    operator = '>' if direction == 'ASC' else '<'
+    if not after:
+        seek = ''
+    elif column == 'song.song_id':
+        seek = f'AND song.song_id {operator} ?'
+    else:
+        seek = f'AND ({column} {operator} ? OR ({column} = ? AND song.song_id > ?))'
+    order_by = f'{column} {direction}' if column == 'song.song_id' else f'{column} {direction}, song.song_id ASC'
+    return SEARCH_QUERY.format(column=column, seek=seek, order_by=order_by)
+
+# Search queries by order and whether they seek past a cursor, built once and planned by check-query-plans
+SEARCH_QUERIES = {(order, after): build_search_query(order, after) for order in ORDERS for after in (False, True)}
+
+# Function to split a search query into tokens
+def get_search_tokens(search_query):
+    return [token for token in search_query.split() if token]
+
+# Function to build the FTS5 match expression for the search tokens
+def build_match_query(search_tokens):
+    terms = ' AND '.join('"' + token.replace('"', '""') + '"*' for token in search_tokens)
+    return ' OR '.join(f'{column} : ({terms})' for column in COLUMNS)
+
+# Function to encode the sort key of the last row of a page as an opaque cursor
+def encode_cursor(sort_key, song_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_key, song_id]).encode('utf-8')).decode('ascii')
+
+# Types of the sort key each order's cursor holds
+CURSOR_KEY_TYPES = {
+    'bm25(song_search)': (int, float),
+    'song.title': (str,),
+    'song.song_id': (int,),
+}
+
+# Function to decode a cursor, returning None if it is not valid or its sort key is not of the order's type
+def decode_cursor(cursor, order='rank'):
+    try:
+        sort_key, song_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    key_types = CURSOR_KEY_TYPES[ORDERS.get(order, ORDERS['rank'])[0]]
+    if type(sort_key) not in key_types or type(song_id) is not int:
+        return None
+    return sort_key, song_id
+
+# Function to search songs, albums, and artists, yielding song rows with album title, image, and artist name.
+# Rows come after the cursor in the chosen order, and page['next'] is set to the next page's cursor once the page is done
+def iter_search_songs(cur, search_query, order='rank', limit=50, after=None, page=None):
+    search_tokens = get_search_tokens(search_query)
+    if not search_tokens:
+        return
+    order = order if order in ORDERS else 'rank'
+    params = [build_match_query(search_tokens)]
+
+    # Seek past the last row of the previous page instead of skipping over it with OFFSET
+    key = decode_cursor(after, order) if after else None
+    if key:
+        params.extend([key[1]] if ORDERS[order][0] == 'song.song_id' else [key[0], key[0], key[1]])
+    cur.execute(SEARCH_QUERIES[(order, bool(key))], params + [limit + 1])
+
+    count = 0
+    last_row = None
+    for rows in iter(lambda: cur.fetchmany(FETCH_SIZE), []):
+        # The album and artist columns come from memory, the sort key stays last
+        for row in catalogue_dimensions.resolve(cur, rows, SEARCH_FIELDS):
+            if count == limit:
+                # One more row than the page holds means there is a next page
+                if page is not None:
+                    page['next'] = encode_cursor(last_row[-1], last_row[0])
+                return
+            yield row[:-1]
+            last_row = row
+            count += 1
+
+# Function to get one page of search results and the cursor of the next page
+def search_songs(cur, search_query, order='rank', limit=50, after=None):
+    page = {'next': None}
+    search_results = list(iter_search_songs(cur, search_query, order, limit, after, page))
+    return search_results, page['next']
+
+# Counters of the search cache table shared across processes
+shared_cache_stats = {'hits': 0, 'misses': 0}
+_shared_cache_lock = threading.Lock()
+
+# Function to build the cache key of a search, queries that differ only in case or spacing share it
+def get_search_key(search_query, order, limit, after):
+    order = order if order in ORDERS else 'rank'
+    return json.dumps([[token.lower() for token in get_search_tokens(search_query)], order, limit, after or None])
+
+# Function to count a lookup in the shared search cache
+def count_shared_lookup(hit):
+    with _shared_cache_lock:
+        shared_cache_stats['hits' if hit else 'misses'] += 1
+
+# Function to look up a cached page of search results, first in process and then in the shared table
+def get_cached_search(cur, key, generation, shared=False):
+    cached = search_cache.get(key, generation)
+    if cached is not None or not shared:
+        return cached
+    row = cur.execute('SELECT results, next_cursor FROM search_cache WHERE key = ? AND generation = ?',
+                      (key, generation)).fetchone()
+    count_shared_lookup(row is not None)
+    if row is None:
+        return None
+    cached = ([tuple(result) for result in json.loads(row[0])], row[1])
+    search_cache.set(key, cached, generation)
+    return cached
+
+# Function to cache a page of search results, also in the shared table when enabled
+def set_cached_search(cur, key, generation, cached, shared=False):
+    search_cache.set(key, cached, generation)
+    if not shared:
+        return
+    now = time.time()
+    cur.execute('INSERT OR REPLACE INTO search_cache (key, generation, results, next_cursor, created_at) VALUES (?, ?, ?, ?, ?)',
+                (key, generation, json.dumps(cached[0]), cached[1], now))
+    if search_cache.ttl:
+        cur.execute('DELETE FROM search_cache WHERE created_at < ?', (now - search_cache.ttl,))
+    cur.connection.commit()
+
+# Function to get one page of search results through the cache, entries of an older catalogue generation are never served
+def cached_search_songs(cur, search_query, order='rank', limit=50, after=None, shared=False):
+    key = get_search_key(search_query, order, limit, after)
+    generation = get_catalogue_generation(cur)
+    cached = get_cached_search(cur, key, generation, shared)
+    if cached is None:
+        cached = search_songs(cur, search_query, order, limit, after)
+        set_cached_search(cur, key, generation, cached, shared)
+    return cached
+
+# CLI command to refill the search index from the catalogue
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    from .schema import init_search_index, rebuild_search_index
+    conn = sqlite3.connect(current_app.config['DATABASE'])
+    cur = conn.cursor()
+    init_search_index(cur)
+    rebuild_search_index(cur)
+    conn.commit()
+    count = cur.execute('SELECT COUNT(*) FROM song_search').fetchone()[0]
+    cur.close()
+    conn.close()
+    click.echo(f'Indexed {count} songs for search.')
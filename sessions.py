@@ -0,0 +1,281 @@
+"""
+sessions.py
+
+This file defines the server-side session store used in place of Flask's signed cookie sessions.
+It includes a session interface that keeps only an opaque session id in the cookie, a SQLite store
+shared by every worker and an in-memory store for a single process, moving a session to a new id
+when the user logs in or out, sweeping of expired sessions, and a CLI command that measures the cookie size and per-request cost of both kinds of sessions.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import secrets
+import time
+import threading
+import click
+from flask import current_app, session
+from flask.cli import with_appcontext
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+from .db import db_pool
+
+# Serializer of session data, the same tagged JSON Flask uses for cookie sessions so tuples and bytes survive
+serializer = TaggedJSONSerializer()
+
+# Session whose data lives on the server, identified by the id in its cookie
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    # Function to move the session to a new id, the old one is dropped from the store when the session is saved
+    def regenerate(self):
+        if self.replaced_sid is None and not self.new:
+            self.replaced_sid = self.sid
+        self.new = False
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+# Store of serialized session data by session id
+class SessionStore:
+    # Function to get a session's data and expiry time, or None if there is no such session
+    def load(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data, expires):
+        raise NotImplementedError
+
+    # Function to extend a session without rewriting its data
+    def touch(self, sid, expires):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    # Function to drop expired sessions, returning how many were dropped
+    def sweep(self, now):
+        raise NotImplementedError
+
+# Session store in the user_session table, shared by every worker process
+class SQLiteSessionStore(SessionStore):
+    def execute(self, query, params):
+        conn = db_pool.acquire()
+        try:
+            cur = conn.execute(query, params)
+            result = cur.fetchone() if query.startswith('SELECT') else cur.rowcount
+            conn.commit()
+            return result
+        finally:
+            db_pool.release(conn)
+
+    def load(self, sid):
+        return self.execute('SELECT data, expires FROM user_session WHERE id = ? AND expires > ?', (sid, time.time()))
+
+    def save(self, sid, data, expires):
+        self.execute('INSERT OR REPLACE INTO user_session (id, data, expires) VALUES (?, ?, ?)', (sid, data, expires))
+
+    def touch(self, sid, expires):
+        self.execute('UPDATE user_session SET expires = ? WHERE id = ?', (expires, sid))
+
+    def delete(self, sid):
+        self.execute('DELETE FROM user_session WHERE id = ?', (sid,))
+
+    def sweep(self, now):
+        return self.execute('DELETE FROM user_session WHERE expires <= ?', (now,))
+
+# Session store in this process's memory, for a single worker or tests
+class MemorySessionStore(SessionStore):
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        entry = self.sessions.get(sid)
+        return entry if entry and entry[1] > time.time() else None
+
+    def save(self, sid, data, expires):
+        with self.lock:
+            self.sessions[sid] = (data, expires)
+
+    def touch(self, sid, expires):
+        with self.lock:
+            if sid in self.sessions:
+                self.sessions[sid] = (self.sessions[sid][0], expires)
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def sweep(self, now):
+        with self.lock:
+            expired = [sid for sid, (_, expires) in self.sessions.items() if expires <= now]
+            for sid in expired:
+                del self.sessions[sid]
+        return len(expired)
+
+# Session stores selectable with the SESSION_TYPE setting
+SESSION_STORES = {
+    'sqlite': SQLiteSessionStore,
+    'memory': MemorySessionStore,
+}
+
+# Session interface that keeps the session data in a store and only an opaque id in the cookie
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store, sweep_interval=300):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.swept_at = time.monotonic()
+
+    def get_signer(self, app):
+        return Signer(app.secret_key, salt='session-id') if app.config['SESSION_USE_SIGNER'] else None
+
+    # Function to read the session id from the cookie, None if it is missing or its signature does not match
+    def get_sid(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        signer = self.get_signer(app)
+        if not value or signer is None:
+            return value
+        try:
+            return signer.unsign(value).decode('ascii')
+        except BadSignature:
+            return None
+
+    # Function to get a session's data and expiry, read from the store on every request so a change made by
+    # another worker is never missed
+    def load(self, sid):
+        entry = self.store.load(sid)
+        if entry is None:
+            return None
+        return serializer.loads(entry[0]), entry[1]
+
+    def open_session(self, app, request):
+        sid = self.get_sid(app, request)
+        # Static files never read the session, so it is not loaded for them
+        if sid and request.path.startswith(f'{app.static_url_path}/'):
+            return ServerSideSession(sid=sid)
+        if sid:
+            entry = self.load(sid)
+            if entry is not None:
+                return ServerSideSession(entry[0], sid=sid, expires=entry[1])
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # A regenerated session's old id is dropped, so whoever still holds it gets an empty session
+        if session.replaced_sid is not None:
+            self.store.delete(session.replaced_sid)
+
+        # An emptied session is dropped from the store along with its cookie
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires = self.get_expiration_time(app, session)
+        stored_until = expires.timestamp() if expires else time.time() + app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            data = serializer.dumps(dict(session))
+            self.store.save(session.sid, data, stored_until)
+        elif session.expires is not None and session.expires - time.time() < app.permanent_session_lifetime.total_seconds() / 2:
+            # Unchanged sessions are only extended once half their lifetime has passed
+            self.store.touch(session.sid, stored_until)
+        self.sweep()
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        signer = self.get_signer(app)
+        value = signer.sign(session.sid).decode('ascii') if signer else session.sid
+        response.set_cookie(name, value, expires=expires, httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app), partitioned=self.get_cookie_partitioned(app))
+        response.vary.add('Cookie')
+
+    # Function to drop expired sessions from the store every few minutes
+    def sweep(self):
+        if time.monotonic() - self.swept_at < self.sweep_interval:
+            return
+        self.swept_at = time.monotonic()
+        self.store.sweep(time.time())
+
+# Function to move the current session to a new id, called when the user logs in, logs out, or changes their account, so
+# a session id planted in or read from the browser before then cannot reach the session after it
+def regenerate_session():
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+# Function to replace the app's cookie sessions with the server-side store chosen by SESSION_TYPE
+def init_sessions(app):
+    store = SESSION_STORES.get(app.config['SESSION_TYPE'])
+    if store is None:
+        return
+    app.session_interface = ServerSideSessionInterface(store(), app.config['SESSION_SWEEP_INTERVAL'])
+
+# CLI command to drop expired sessions
+@click.command('sweep-sessions')
+@with_appcontext
+def sweep_sessions_command():
+    store = SESSION_STORES.get(current_app.config['SESSION_TYPE'], SQLiteSessionStore)()
+    click.echo(f'Dropped {store.sweep(time.time())} expired sessions.')
+
+# Function to time a function in microseconds per call
+def time_calls(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) * 1e6 / repeat
+
+# CLI command to compare the cookie size and per-request session cost of cookie and server-side sessions
+@click.command('session-report')
+@click.option('--repeat', type=int, default=1000, help='Requests timed for each measurement.')
+@with_appcontext
+def session_report_command(repeat):
+    import sqlite3
+
+    # A logged in user's session, with the featured song row the home page keeps in it
+    conn = sqlite3.connect(current_app.config['DATABASE'])
+    user = conn.execute('SELECT * FROM user LIMIT 1').fetchone()
+    featured_song = conn.execute(
+        'SELECT song.*, artist.name, album.title, album.image_url FROM song JOIN artist ON song.artist_id = artist.artist_id JOIN album ON song.album_id = album.album_id LIMIT 1').fetchone()
+    conn.close()
+    data = {
+        'user': {'user_id': user[0], 'username': user[1], 'email': user[2], 'date_of_birth': user[5], 'admin': user[6]}
+        if user else {},
+        'featured_song': featured_song,
+    }
+    app = current_app._get_current_object()
+
+    # Cookie session: every request verifies and decodes the cookie, and re-signs it when the session is refreshed
+    cookie_serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    cookie = cookie_serializer.dumps(data)
+    cookie_open = time_calls(lambda: cookie_serializer.loads(cookie), repeat)
+    cookie_save = time_calls(lambda: cookie_serializer.dumps(data), repeat)
+
+    # Server-side session: the cookie holds a signed id, and the data is read from the store
+    interface = ServerSideSessionInterface(SESSION_STORES.get(app.config['SESSION_TYPE'], SQLiteSessionStore)())
+    sid = secrets.token_urlsafe(32)
+    signer = interface.get_signer(app)
+    value = signer.sign(sid).decode('ascii') if signer else sid
+    stored = serializer.dumps(data)
+    interface.store.save(sid, stored, time.time() + 60)
+    server_open = time_calls(lambda: (signer.unsign(value) if signer else value, interface.load(sid)), repeat)
+    server_save = time_calls(lambda: interface.store.save(sid, serializer.dumps(data), time.time() + 60), repeat)
+    interface.store.delete(sid)
+
+    click.echo(f'{"":<24} {"cookie bytes":>12} {"open us":>9} {"save us":>9}')
+    click.echo(f'{"cookie session":<24} {len(cookie):>12} {cookie_open:>9.1f} {cookie_save:>9.1f}')
+    click.echo(f'{"server-side session":<24} {len(value):>12} {server_open:>9.1f} {server_save:>9.1f}')
+    click.echo('Cookie sessions pay the open cost on every request, including static files, and the save cost whenever '
+               'the session is refreshed; server-side sessions only save when the session changes.')
@@ -0,0 +1,114 @@
+"""
+startup.py
+
+This file defines the startup lifecycle of the application, chosen with the STARTUP_MODE setting.
+It includes a preload mode that imports the recommender's heavy modules and loads the model and
+featured songs before the server forks its workers, so they share those pages copy-on-write and
+serve their first suggestion without waiting, a light mode that serves only precomputed suggestions
+so the web tier never imports pandas or scikit-learn, and a CLI command that reports the time to
+first request in each mode.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import gc
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Startup modes: 'lazy' loads the recommender on the first suggestion, 'preload' before forking, 'light' never
+STARTUP_MODES = ['lazy', 'preload', 'light']
+
+# Modules that only the recommender's fit and model loading need
+HEAVY_MODULES = ['pandas', 'sklearn', 'scipy']
+
+# Function to load everything the first requests would otherwise load, in the process that forks the workers
+def preload(app):
+    from .autocomplete import autocomplete_index
+    from .featured import featured_songs
+    from .recommender import load_model, load_feature_store
+
+    with app.app_context():
+        if app.config['RECOMMENDER_MODE'] == 'audio':
+            load_feature_store(app.config['DATABASE'])
+        else:
+            # Loading the model imports scipy to unpickle its matrix, and pandas and scikit-learn if it has to be fitted
+            load_model(app.config['DATABASE'])
+        featured_songs.refresh()
+        autocomplete_index.load()
+
+    # Objects created so far are kept out of garbage collection, which would otherwise write to their pages in every worker
+    gc.collect()
+    gc.freeze()
+
+# Function to run the startup lifecycle of the configured mode
+def init_startup(app):
+    mode = app.config['STARTUP_MODE']
+    if mode not in STARTUP_MODES:
+        raise ValueError(f'STARTUP_MODE must be one of {", ".join(STARTUP_MODES)}, not {mode!r}.')
+    if mode == 'preload':
+        preload(app)
+
+# Function to tell whether suggestions are only read precomputed, never computed in the web process
+def serves_precomputed(config):
+    return bool(config['RECOMMENDER_WORKERS']) or config['STARTUP_MODE'] == 'light'
+
+# Function to measure a fresh process's startup and first requests, printed as JSON for startup-report
+def measure(database, mode, started):
+    # The package is imported by name from its parent directory, in place of this script's own directory
+    package = os.path.dirname(os.path.abspath(__file__))
+    sys.path[0] = os.path.dirname(package)
+    create_app = __import__(os.path.basename(package)).create_app
+    app = create_app({'DATABASE': database, 'STARTUP_MODE': mode})
+    ready = time.time()
+
+    conn = sqlite3.connect(database)
+    user_id = conn.execute('SELECT user_id FROM playlist ORDER BY playlist_id LIMIT 1').fetchone()[0]
+    conn.close()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'user_id': user_id, 'username': '', 'email': '', 'date_of_birth': '', 'admin': 0}
+    timings = []
+    for _ in range(2):
+        request_started = time.time()
+        status = client.get('/views/browse').status_code
+        timings.append((time.time() - request_started) * 1000)
+    print(json.dumps({
+        'mode': mode,
+        'startup_s': ready - started,
+        'first_request_ms': timings[0],
+        'second_request_ms': timings[1],
+        'time_to_first_response_s': ready - started + timings[0] / 1000,
+        'status': status,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+# CLI command to report the startup time, first request latency, and heavy modules loaded in each startup mode
+@click.command('startup-report')
+@click.option('--mode', 'modes', multiple=True, type=click.Choice(STARTUP_MODES), help='Modes to measure, defaults to all.')
+@with_appcontext
+def startup_report_command(modes):
+    database = os.path.abspath(current_app.config['DATABASE'])
+    click.echo(f'{"mode":<8} {"startup s":>10} {"1st request ms":>15} {"2nd request ms":>15} {"to 1st response s":>18}  heavy modules')
+    for mode in modes or STARTUP_MODES:
+        # Every mode starts in a new interpreter, so nothing it imports is already loaded
+        started = time.time()
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), database, mode, str(started)],
+                                capture_output=True, text=True)
+        if result.returncode:
+            raise click.ClickException(f'{mode} startup failed:\n{result.stderr}')
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        click.echo(f'{mode:<8} {report["startup_s"]:>10.2f} {report["first_request_ms"]:>15.1f} '
+                   f'{report["second_request_ms"]:>15.1f} {report["time_to_first_response_s"]:>18.2f}  '
+                   f'{", ".join(report["heavy_modules"]) or "none"}')
+    click.echo('Preload pays the model load once before the workers fork; light only serves suggestions '
+               'precomputed by `flask recommend-all` or the background jobs.')
+
+if __name__ == '__main__':
+    measure(sys.argv[1], sys.argv[2], float(sys.argv[3]))
@@ -0,0 +1,89 @@
+"""
+taste.py
+
+This file defines the running taste vector kept for each playlist, the sum and count of the audio
+features of its songs. Adding or removing a song updates the stored vector in constant time, so
+suggestions for a playlist need a single query vector no matter how many songs it holds.
+
+Author: Matt Lucia
+Date: 10/18/2026
+"""
+import json
+import numpy as np
+from .recommender import FEATURES
+
+# Queries that read the audio features of one song, of the songs listed in a JSON array, and of a playlist's songs
+SONG_FEATURES_QUERY = f'SELECT {", ".join(FEATURES)} FROM song_data WHERE song_id = ?'
+LISTED_SONGS_FEATURES_QUERY = f'SELECT {", ".join("song_data." + feature for feature in FEATURES)} FROM json_each(?) AS listed JOIN song_data ON song_data.song_id = listed.value'
+PLAYLIST_FEATURES_QUERY = f'SELECT {", ".join("song_data." + feature for feature in FEATURES)} FROM playlist_songs JOIN song_data ON song_data.song_id = playlist_songs.song_id WHERE playlist_songs.playlist_id = ?'
+
+# Function to get the summed audio features and row count of a song
+def get_song_features(cur, song_id):
+    rows = cur.execute(SONG_FEATURES_QUERY, (song_id,)).fetchall()
+    return len(rows), np.asarray(rows, dtype=np.float64).reshape(-1, len(FEATURES)).sum(axis=0)
+
+# Function to get the summed audio features and row count of several songs
+def get_songs_features(cur, song_ids):
+    rows = cur.execute(LISTED_SONGS_FEATURES_QUERY, (json.dumps(list(song_ids)),)).fetchall()
+    return len(rows), np.asarray(rows, dtype=np.float64).reshape(-1, len(FEATURES)).sum(axis=0)
+
+# Function to compute a playlist's taste vector from all of its songs
+def compute_taste(cur, playlist_id):
+    rows = cur.execute(PLAYLIST_FEATURES_QUERY, (playlist_id,)).fetchall()
+    return len(rows), np.asarray(rows, dtype=np.float64).reshape(-1, len(FEATURES)).sum(axis=0)
+
+# Function to store a playlist's taste vector
+def save_taste(cur, playlist_id, count, feature_sum):
+    cur.execute('INSERT OR REPLACE INTO playlist_taste (playlist_id, song_count, feature_sum) VALUES (?, ?, ?)',
+                (playlist_id, count, np.asarray(feature_sum, dtype=np.float64).tobytes()))
+
+# Function to get a playlist's taste vector, computing and storing it the first time
+def get_taste(cur, playlist_id):
+    row = cur.execute(
+        'SELECT song_count, feature_sum FROM playlist_taste WHERE playlist_id = ?', (playlist_id,)).fetchone()
+    if row:
+        return row[0], np.frombuffer(row[1], dtype=np.float64)
+    count, feature_sum = compute_taste(cur, playlist_id)
+    save_taste(cur, playlist_id, count, feature_sum)
+    cur.connection.commit()
+    return count, feature_sum
+
+# Function to add (copies > 0) or remove (copies < 0) one song's features from a playlist's taste vector
+def update_taste(cur, playlist_id, song_id, copies=1):
+    row = cur.execute(
+        'SELECT song_count, feature_sum FROM playlist_taste WHERE playlist_id = ?', (playlist_id,)).fetchone()
+    if not row:
+        # No stored vector yet, it is computed from the playlist's current songs on first use
+        return
+    count, feature_sum = get_song_features(cur, song_id)
+    new_count = max(0, row[0] + copies * count)
+    new_sum = np.frombuffer(row[1], dtype=np.float64) + copies * feature_sum
+    save_taste(cur, playlist_id, new_count, new_sum if new_count else np.zeros(len(FEATURES)))
+
+# Function to add and remove several songs' features from a playlist's taste vector in one update
+def update_taste_batch(cur, playlist_id, added, removed):
+    row = cur.execute(
+        'SELECT song_count, feature_sum FROM playlist_taste WHERE playlist_id = ?', (playlist_id,)).fetchone()
+    if not row or not (added or removed):
+        return
+    added_count, added_sum = get_songs_features(cur, added)
+    removed_count, removed_sum = get_songs_features(cur, removed)
+    new_count = max(0, row[0] + added_count - removed_count)
+    new_sum = np.frombuffer(row[1], dtype=np.float64) + added_sum - removed_sum
+    save_taste(cur, playlist_id, new_count, new_sum if new_count else np.zeros(len(FEATURES)))
+
+# Function to drop a playlist's taste vector
+def delete_taste(cur, playlist_id):
+    cur.execute('DELETE FROM playlist_taste WHERE playlist_id = ?', (playlist_id,))
+
+# Function to recompute every playlist's taste vector, used after catalogue changes
+def rebuild_tastes(conn):
+    cur = conn.cursor()
+    cur.execute('DELETE FROM playlist_taste')
+    playlist_ids = [row[0] for row in cur.execute('SELECT playlist_id FROM playlist').fetchall()]
+    for playlist_id in playlist_ids:
+        count, feature_sum = compute_taste(cur, playlist_id)
+        save_taste(cur, playlist_id, count, feature_sum)
+    conn.commit()
+    cur.close()
+    return len(playlist_ids)
@@ -3,101 +3,130 @@ views.py
 
 This file defines the views blueprint for the Flask application.
 It includes routes for the home page, dashboard, playlist songs, search, playlist creation,
-browsing, adding songs to playlists, and various other actions related to the user interface.
+browsing, adding songs to playlists, bulk catalogue imports, and various other actions related to the user interface.
 
 Author: Matt Lucia
 Date: 01/30/2024
 """
-from flask import Blueprint, render_template, session, request, redirect, url_for, flash
-import sqlite3
-import random
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from flask import Blueprint, render_template, stream_template, session, request, redirect, url_for, flash, current_app, jsonify, make_response
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from .recommender import get_playlist_version, recommend_songs, get_model_path, get_feature_store_path
+from .cache import recommendation_cache, popular_songs_cache, search_cache, fragment_cache
+from .jobs import recommendation_jobs, read_recommendations, delete_recommendations
+from .search import cached_search_songs, iter_search_songs, get_search_key, get_cached_search, shared_cache_stats
+from .schema import get_catalogue_generation, bump_catalogue_generation, get_page_version, bump_user_version, \
+    bump_playlist_version
+from .taste import update_taste, update_taste_batch, delete_taste
+from .autocomplete import autocomplete_index, get_song_records
+from .catalogue import catalogue_dimensions, ALL_FIELDS
+from .db import get_db, db_pool
+from .featured import featured_songs
+from .startup import serves_precomputed
+from .importer import KINDS, get_format, get_text_stream, import_stream
 
 # Create authentication blueprint
 views = Blueprint('views', __name__)
 
-# Set the database filename
+# Set the default database filename, the app reads it from the DATABASE setting
 DATABASE = 'HarmonyVault.db'
 
-# Function to generate song suggestions based on playlist
-def get_recommended_songs(playlist_id):
-    # Retrieve song data from database
-    conn = sqlite3.connect(DATABASE)
+# Function to get the most popular songs, shown while a playlist's suggestions are being computed
+def get_popular_songs(cur, count=10):
+    popular_songs = popular_songs_cache.get('popular')
+    if popular_songs is None:
+        # Songs whose album or artist was deleted are left out before the limit, the rest are resolved in memory
+        popular_songs = cur.execute(
+            'SELECT song.* FROM song_data JOIN song ON song.song_id = song_data.song_id WHERE EXISTS (SELECT 1 FROM album WHERE album.album_id = song.album_id) AND EXISTS (SELECT 1 FROM artist WHERE artist.artist_id = song.artist_id) ORDER BY song_data.popularity DESC LIMIT ?', (count,)).fetchall()
+        popular_songs = catalogue_dimensions.resolve(cur, popular_songs)
+        popular_songs_cache.set('popular', popular_songs)
+    return popular_songs
+
+# Function to generate song suggestions based on playlist, and whether they match its current contents
+def get_recommendations(playlist_id):
+    conn = get_db()
     cur = conn.cursor()
-    playlist_song_data = cur.execute(
-        'SELECT song.title FROM song JOIN playlist_songs ON song.song_id = playlist_songs.song_id WHERE playlist_songs.playlist_id = ?', (playlist_id,)).fetchall()
-
-    # Import necessary modules
-    import pandas as pd
-    from sklearn.model_selection import train_test_split
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import linear_kernel
-
-    # Load table into dataframe
-    conn = sqlite3.connect(DATABASE)
-    query = '''SELECT title, popularity, danceability, energy, loudness, speechiness, acousticness,
-                instrumentalness, liveness, valence FROM song_data'''
-    music_data = pd.read_sql_query(query, conn)
-
-    # List of features to train model on
-    features = ['popularity', 'danceability', 'energy', 'loudness', 'speechiness',
-                'acousticness', 'instrumentalness', 'liveness', 'valence']
-    music_data['combined_features'] = music_data.apply(
-        lambda row: ' '.join([str(row[feature]) for feature in features]), axis=1)
-    
-    # Split data into training and testing sets
-    train_data, test_data = train_test_split(
-        music_data, test_size=0.2, random_state=42)
-
-    train_data.reset_index(drop=True, inplace=True)
-
-    tfidf_vectorizer = TfidfVectorizer()
-    tfidf_matrix = tfidf_vectorizer.fit_transform(
-        train_data['combined_features'])
-
-    cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
-
-    def get_recommendations(song_names, cosine_sim=cosine_sim):
-        song_indices = []
-
-        # Get the indices of all input songs
-        for song_name in song_names:
-            song_index = train_data[train_data['title'] == song_name].index
-            if not song_index.empty:
-                song_indices.extend(song_index)
-
-        # Aggregate similarity scores for all input songs
-        aggregate_sim_scores = [0] * len(train_data)
-        for song_index in song_indices:
-            aggregate_sim_scores = [
-                x + y for x, y in zip(aggregate_sim_scores, cosine_sim[song_index])]
-
-        # Sort and get recommendations
-        sim_scores = list(enumerate(aggregate_sim_scores))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-        recommended_indices = [i[0] for i in sim_scores[1:11]]
 
-        return train_data['title'].iloc[recommended_indices]
-
-    playlist_song_data = [song[0] for song in playlist_song_data]
+    # Serve cached suggestions while the playlist content and the catalogue, edited by any worker, are unchanged
+    version = get_playlist_version(cur, playlist_id)
+    cache_version = (version, get_catalogue_generation(cur))
+    recommended_songs = recommendation_cache.get(str(playlist_id), cache_version)
+    if recommended_songs is not None:
+        cur.close()
+        return recommended_songs, True
+
+    if serves_precomputed(current_app.config):
+        # Read the suggestions precomputed in the background, scheduling a job when they are missing or out of date
+        recommended_songs, fresh = read_recommendations(cur, playlist_id, version)
+        if not fresh:
+            recommendation_jobs.schedule(playlist_id)
+        if recommended_songs is None:
+            recommended_songs = get_popular_songs(cur)
+    else:
+        # Generate suggested songs from playlist data using the preloaded model
+        recommended_songs = recommend_songs(cur, playlist_id, current_app.config['DATABASE'])
+        fresh = True
 
-    # Generate suggested songs from playlist data
-    recommendations = get_recommendations(playlist_song_data)
-    results = str(recommendations).split('\n')
-    d = {}
-    for line in results:
-        parts = list(filter(None, line.split()))
+    cur.close()
+    if fresh:
+        recommendation_cache.set(str(playlist_id), recommended_songs, cache_version)
+    return recommended_songs, fresh
 
-        number = parts[0]
-        result = ' '.join(parts[1:])
+# Function to get a playlist's song suggestions
+def get_recommended_songs(playlist_id):
+    return get_recommendations(playlist_id)[0]
 
-        d[number] = result
+# Function to get when the recommender's model or feature store file was last replaced, 0 if it was never built
+def get_model_stamp():
+    database = current_app.config['DATABASE']
+    path = get_feature_store_path(database) if current_app.config['RECOMMENDER_MODE'] == 'audio' else get_model_path(database)
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
 
-    songs = list(d.values())[:-1]
-    cur.execute('SELECT song.*, artist.name, album.title, album.image_url FROM song JOIN artist ON song.artist_id = artist.artist_id JOIN album ON song.album_id = album.album_id WHERE song.title IN (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', songs)
-    recommended_songs = cur.fetchall()
+# Function to get the validators of a page built from a playlist's or a user's version and the catalogue generation
+def get_page_validators(kind, record_id):
+    conn = get_db()
+    cur = conn.cursor()
+    generation, generation_modified, version, modified = get_page_version(cur, kind, record_id)
     cur.close()
-    conn.close()
-    return recommended_songs
+    # Everything the page's content depends on besides the viewer, also the version its cached fragments are checked against
+    fragment_version = (version or 0, generation, current_app.config['RECOMMENDER_MODE'], get_model_stamp())
+    etag = hashlib.sha1(repr((request.endpoint, record_id, session['user']['user_id'], fragment_version)).encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(max(generation_modified or 0, modified or 0), timezone.utc)
+    return etag, last_modified, fragment_version
+
+# Function to tell whether the client's copy of a page is current, pages with messages to flash are always sent
+def is_page_current(validators):
+    return not session.get('_flashes') and \
+        not is_resource_modified(request.environ, etag=validators[0], last_modified=validators[1])
+
+# Function to add the validators to a page response, or answer 304 Not Modified when the body is None
+def page_response(body, validators):
+    response = make_response(body if body is not None else '', 200 if body is not None else 304)
+    response.set_etag(validators[0])
+    response.last_modified = validators[1]
+    # Pages are per user and revalidated on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Function to render a playlist's suggested songs, or get them from the fragment cache while the page version is unchanged
+def render_suggestions(template, playlist_id, fragment_version):
+    key = f'{template}:{playlist_id}'
+    html = fragment_cache.get(key, fragment_version)
+    if html is None:
+        recommended_songs, fresh = get_recommendations(playlist_id)
+        html = Markup(render_template(template, playlist_id=playlist_id, recommendations=recommended_songs))
+        # Popular songs standing in for missing suggestions, or suggestions of older contents, are not kept past this request
+        if fresh:
+            fragment_cache.set(key, html, fragment_version)
+    return html
 
 # Home route
 @views.route('/', methods=['GET', 'POST'])
@@ -105,14 +134,8 @@ def home():
     user = session.get('user')
     featured_song = session.get('featured_song', '')
     if not featured_song:
-        # Generate random featured song
-        random_song_id = random.randint(339253, 345448)
-        conn = sqlite3.connect(DATABASE)
-        cur = conn.cursor()
-        featured_song = cur.execute(
-            'SELECT song.*, artist.name, album.title, album.image_url FROM song JOIN artist ON song.artist_id = artist.artist_id JOIN album ON song.album_id = album.album_id WHERE song_id = ?', (random_song_id,)).fetchone()
-        cur.close()
-        conn.close()
+        # Pick a featured song from the preloaded pool
+        featured_song = featured_songs.sample()
         session['featured_song'] = featured_song
     return render_template('home.html', user=user, featured_song=featured_song)
 
@@ -122,76 +145,115 @@ def dashboard():
     user = session.get('user', {})
     if not user:
         return redirect((url_for('auth.login')))
-    # Retrieve music data from database
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
     if request.method == 'GET':
+        # Answer from the client's copy while the user's playlists are unchanged
+        validators = get_page_validators('user', user['user_id'])
+        if is_page_current(validators):
+            return page_response(None, validators)
+
+        # Retrieve music data from database
+        conn = get_db()
+        cur = conn.cursor()
         playlists = cur.execute(
             'SELECT * FROM playlist WHERE user_id = ?', (user['user_id'],)).fetchall()
-        return render_template('dashboard.html', playlists=playlists)
-    cur.close()
-    conn.close()
+        cur.close()
+        return page_response(render_template('dashboard.html', playlists=playlists), validators)
     return render_template('dashboard.html', user=user)
 
 # Route for displaying playlist contents
 @views.route('/playlist_songs/<playlist_id>', methods=['GET', 'POST'])
 def playlist_songs(playlist_id):
-    conn = sqlite3.connect(DATABASE)
+    # Answer from the client's copy while the playlist and catalogue are unchanged
+    validators = None
+    if session.get('user') and request.method == 'GET':
+        validators = get_page_validators('playlist', playlist_id)
+        if is_page_current(validators):
+            return page_response(None, validators)
+
+    conn = get_db()
     cur = conn.cursor()
 
     # Retrieve playlist content
     playlist = cur.execute(
         'SELECT * FROM playlist WHERE playlist_id = ?', (playlist_id,)).fetchone()
     playlist_songs = cur.execute(
-        'SELECT song.*, artist.*, album.*  FROM playlist_songs JOIN song ON playlist_songs.song_id = song.song_id JOIN artist ON song.artist_id = artist.artist_id JOIN album ON song.album_id = album.album_id WHERE playlist_id = ?', (playlist_id,)).fetchall()
-
-    # Generate suggested songs for the playlist
-    recommended_songs = get_recommended_songs(playlist_id)
+        'SELECT song.* FROM playlist_songs JOIN song ON playlist_songs.song_id = song.song_id WHERE playlist_id = ? ORDER BY playlist_songs.position', (playlist_id,)).fetchall()
+    playlist_songs = catalogue_dimensions.resolve(cur, playlist_songs, ALL_FIELDS)
 
     cur.close()
-    conn.close()
-    return render_template('playlist_songs.html', playlist=playlist, playlist_songs=playlist_songs, recommendations=recommended_songs)
+
+    # Generate suggested songs for the playlist, the rendered block is reused while the page version is unchanged
+    if validators is None:
+        suggestions = Markup(render_template('playlist_suggestions.html', playlist_id=playlist_id,
+                                             recommendations=get_recommended_songs(playlist_id)))
+        return render_template('playlist_songs.html', playlist=playlist, playlist_songs=playlist_songs, suggestions=suggestions)
+    suggestions = render_suggestions('playlist_suggestions.html', playlist_id, validators[2])
+    return page_response(render_template('playlist_songs.html', playlist=playlist, playlist_songs=playlist_songs,
+                                         suggestions=suggestions), validators)
 
 # Route for search
 @views.route('/search', methods=['GET', 'POST'])
 def search():
-    if request.method == 'POST':
-        # Process search query
-        search_query = request.form.get('search', '')
-        order = request.form.get('order', '')
+    if request.method == 'POST' or 'search' in request.args:
+        # Process search query, later pages are requested with the cursor of the previous one
+        search_query = request.values.get('search', '')
+        order = request.values.get('order', '')
         if not order:
-            order = 'song_id DESC'
-
-        search_tokens = search_query.split(' ')
-
-        # Retrieve search results from database
-        query = f'''SELECT DISTINCT song.*, album.title, album.image_url, artist.name FROM song
-                    JOIN album ON song.album_id = album.album_id
-                    JOIN artist ON song.artist_id = artist.artist_id
-                    WHERE {' AND '.join(['song.title LIKE ?' for _ in range(len(search_tokens))])}
-                        OR {' AND '.join(['album.title LIKE ?' for _ in range(len(search_tokens))])}
-                        OR {' AND '.join(['artist.name LIKE ?' for _ in range(len(search_tokens))])}
-                    ORDER BY {order}'''
-
-        conn = sqlite3.connect(DATABASE)
+            order = 'rank'
+        after = request.args.get('after', '')
+        # A page holds at least one result and at most SEARCH_MAX_PAGE_SIZE
+        per_page = max(1, min(request.args.get('per_page', current_app.config['SEARCH_PAGE_SIZE'], type=int),
+                              current_app.config['SEARCH_MAX_PAGE_SIZE']))
+        page = {'next': None}
+
+        shared = current_app.config['SEARCH_CACHE_SHARED']
+
+        if request.args.get('stream'):
+            # Render cached results at once, otherwise render them as they are read so the first bytes do not wait for the whole page
+            conn = get_db()
+            cur = conn.cursor()
+            cached = get_cached_search(cur, get_search_key(search_query, order, per_page, after),
+                                       get_catalogue_generation(cur), shared)
+            cur.close()
+            if cached is not None:
+                page['next'] = cached[1]
+                return stream_template('search.html', search_results=cached[0], page=page,
+                                       search_query=search_query, order=order, per_page=per_page, stream=True)
+
+            def stream_results():
+                cur = get_db().cursor()
+                try:
+                    yield from iter_search_songs(cur, search_query, order, per_page, after, page)
+                finally:
+                    cur.close()
+            return stream_template('search.html', search_results=stream_results(), page=page,
+                                   search_query=search_query, order=order, per_page=per_page, stream=True)
+
+        # Retrieve search results from the cache or the full-text index, best matches first
+        conn = get_db()
         cur = conn.cursor()
 
-        params = ['%' + token + '%' for token in search_tokens]
-
-        cur.execute(query, params * 3)
-        search_results = cur.fetchall()
+        search_results, page['next'] = cached_search_songs(cur, search_query, order, per_page, after, shared)
 
         cur.close()
-        conn.close()
 
         flash(f'Retrieved {len(search_results)} result(s) matching your search.', category="success")
-        return render_template('search.html', search_results=search_results)
+        return render_template('search.html', search_results=search_results, page=page,
+                               search_query=search_query, order=order, per_page=per_page)
     else:
         search_results = session.get('search_results', '')
         if search_results:
             return render_template('search.html', search_results=search_results)
         return render_template('search.html')
 
+# Route for live search box suggestions, the most popular songs, albums, and artists with a word starting with the query
+@views.route('/autocomplete')
+def autocomplete():
+    autocomplete_index.check()
+    search_query = request.args.get('q', '')
+    limit = request.args.get('limit', current_app.config['AUTOCOMPLETE_SIZE'], type=int)
+    return jsonify({'query': search_query, 'results': autocomplete_index.search(search_query, limit)})
+
 # Route for playlist creation
 @views.route('/create_playlist', methods=['GET', 'POST'])
 def create_playlist():
@@ -209,19 +271,19 @@ def create_playlist():
         attributes = [user_id, title, description, imageURL]
         
         # Insert new playlist data to database
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cur = conn.cursor()
 
         try:
             cur.execute(
                 'INSERT INTO playlist (user_id, title, description, image_url) VALUES (?, ?, ?, ?)', attributes)
+            bump_user_version(cur, user_id)
             conn.commit()
         except Exception:
             flash('Error creating new playlist', category="error")
             return redirect(url_for('views.dashboard'))
 
         cur.close()
-        conn.close()
         flash('Playlist created.', category="success")
         return redirect(url_for('views.dashboard'))
     return render_template('create_playlist.html', user=user)
@@ -234,41 +296,131 @@ def browse():
         flash('Error. No user found.', category='error')
         return redirect(url_for('views.home'))
     
+    # Answer from the client's copy while the user's playlists and the catalogue are unchanged
+    validators = get_page_validators('user', user['user_id'])
+    if is_page_current(validators):
+        return page_response(None, validators)
+
     # Retrieve user library content
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
     user_id = session['user']['user_id']
     playlist_id = cur.execute(
         'SELECT playlist_id FROM playlist WHERE user_id = ?', (user_id,)).fetchone()[0]
-
-    # Genereate song suggestions based on user library content
-    recommended_songs = get_recommended_songs(playlist_id)
-
     cur.close()
-    conn.close()
-    return render_template('browse.html', recommended_songs=recommended_songs)
+
+    # Genereate song suggestions based on user library content, the rendered block is reused while the page version is unchanged
+    suggestions = render_suggestions('browse_suggestions.html', playlist_id, validators[2])
+    return page_response(render_template('browse.html', suggestions=suggestions), validators)
 
 # Route to add a song to specified playlist
 @views.route('/add_song/<playlist_id>/<song_id>')
 def add_song(playlist_id, song_id):
     # Add song to playlist in database
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
     try:
         cur.execute(
-            'INSERT INTO playlist_songs (playlist_id, song_id) VALUES (?, ?)', (playlist_id, song_id,))
+            'INSERT OR IGNORE INTO playlist_songs (playlist_id, song_id) VALUES (?, ?)', (playlist_id, song_id,))
+        added = cur.rowcount
+        if added:
+            update_taste(cur, playlist_id, song_id, 1)
+            bump_playlist_version(cur, playlist_id)
         conn.commit()
     except Exception:
         flash('Error adding song to playlist.', category="error")
         return redirect(url_for('views.playlist_songs', playlist_id=playlist_id))
 
+    # Playlist membership is unique, so adding a song twice changes nothing
+    if not added:
+        cur.close()
+        flash('Song is already in playlist.', category='success')
+        return redirect(url_for('views.playlist_songs', playlist_id=playlist_id))
+
     cur.close()
-    conn.close()
+    recommendation_cache.invalidate(str(playlist_id))
+    recommendation_jobs.schedule(playlist_id)
 
     flash('Added song to playlist.', category='success')
     return redirect(url_for('views.playlist_songs', playlist_id=playlist_id))
 
+# Function to read a list of song ids from a batch edit request, None if it is not one
+def get_song_ids(edits, name):
+    song_ids = edits.get(name, [])
+    if not isinstance(song_ids, list) or not all(isinstance(song_id, int) and not isinstance(song_id, bool) for song_id in song_ids):
+        return None
+    return song_ids
+
+# Route to add, remove, and reorder many songs of a playlist in one transaction, answering with the playlist's new songs
+@views.route('/playlist_songs/<playlist_id>/batch', methods=['POST'])
+def batch_playlist_songs(playlist_id):
+    user = session.get('user', '')
+    if not user:
+        return jsonify({'error': 'Not logged in.'}), 401
+
+    # The body lists song ids to remove, then to add at the end, then to move to the front in the given order
+    edits = request.get_json(silent=True)
+    if not isinstance(edits, dict):
+        return jsonify({'error': 'Expected a JSON object with add, remove, and order lists of song ids.'}), 400
+    add, remove, order = get_song_ids(edits, 'add'), get_song_ids(edits, 'remove'), get_song_ids(edits, 'order')
+    if add is None or remove is None or order is None:
+        return jsonify({'error': 'add, remove, and order must be lists of song ids.'}), 400
+    if len(add) + len(remove) + len(order) > current_app.config['PLAYLIST_BATCH_LIMIT']:
+        return jsonify({'error': f'A batch edits at most {current_app.config["PLAYLIST_BATCH_LIMIT"]} songs.'}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    playlist = cur.execute('SELECT user_id FROM playlist WHERE playlist_id = ?', (playlist_id,)).fetchone()
+    if not playlist or (playlist[0] != user['user_id'] and not user.get('admin')):
+        cur.close()
+        return jsonify({'error': 'Playlist not found.'}), 404
+
+    try:
+        removed = [row[0] for row in cur.execute(
+            'DELETE FROM playlist_songs WHERE playlist_id = ? AND song_id IN (SELECT value FROM json_each(?)) RETURNING song_id',
+            (playlist_id, json.dumps(remove))).fetchall()]
+        # Songs missing from the catalogue or already in the playlist are skipped, the rest are appended in the given order
+        added = [row[0] for row in cur.execute(
+            'INSERT OR IGNORE INTO playlist_songs (playlist_id, song_id) SELECT ?, song.song_id FROM json_each(?) AS listed JOIN song ON song.song_id = listed.value ORDER BY listed.key RETURNING song_id',
+            (playlist_id, json.dumps(add))).fetchall()]
+        if order:
+            current = [row[0] for row in cur.execute(
+                'SELECT song_id FROM playlist_songs WHERE playlist_id = ? ORDER BY position', (playlist_id,)).fetchall()]
+            members = set(current)
+            ordered = list(dict.fromkeys(song_id for song_id in order if song_id in members))
+            moved = set(ordered)
+            ordered += [song_id for song_id in current if song_id not in moved]
+            cur.executemany('UPDATE playlist_songs SET position = ? WHERE playlist_id = ? AND song_id = ?',
+                            [(position, playlist_id, song_id) for position, song_id in enumerate(ordered)])
+        update_taste_batch(cur, playlist_id, added, removed)
+        if added or removed or order:
+            bump_playlist_version(cur, playlist_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        cur.close()
+        return jsonify({'error': 'Error editing playlist.'}), 500
+
+    songs = catalogue_dimensions.resolve(cur, cur.execute(
+        'SELECT song.* FROM playlist_songs JOIN song ON playlist_songs.song_id = song.song_id WHERE playlist_id = ? ORDER BY playlist_songs.position',
+        (playlist_id,)).fetchall())
+    cur.close()
+
+    # Suggestions only depend on which songs are in the playlist, so a reorder alone keeps them
+    if added or removed:
+        recommendation_cache.invalidate(str(playlist_id))
+        recommendation_jobs.schedule(playlist_id)
+
+    return jsonify({
+        'playlist_id': int(playlist_id),
+        'added': added,
+        'removed': removed,
+        'songs': [{'song_id': row[0], 'title': row[3], 'artist': row[6], 'album': row[7], 'image_url': row[8]}
+                  for row in songs],
+    })
+
 # Route to select playlist to add a specified song to
 @views.route('/select_playlist/<song_id>', methods=['GET', 'POST'])
 def select_playlist(song_id):
@@ -277,7 +429,7 @@ def select_playlist(song_id):
         return redirect(url_for('auth.login'))
     
     # Retrieve playlists options to display
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
     user_id = session['user']['user_id']
@@ -285,14 +437,13 @@ def select_playlist(song_id):
         'SELECT * FROM playlist WHERE user_id = ?', (user_id,)).fetchall()
 
     cur.close()
-    conn.close()
 
     return render_template('select_playlist.html', song_id=song_id, playlists=playlists)
 
 # Route for deleting a specified playlist
 @views.route('/delete_playlist/<playlist_id>')
 def delete_playlist(playlist_id):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
     # Prevent deletion for user library
@@ -304,15 +455,19 @@ def delete_playlist(playlist_id):
     
     # Remove playlist from database
     try:
+        # Bumped before the delete, while the playlist's owner can still be looked up
+        bump_playlist_version(cur, playlist_id)
         cur.execute('DELETE FROM playlist WHERE playlist_id = ?',
                     (playlist_id,))
+        delete_taste(cur, playlist_id)
+        delete_recommendations(cur, playlist_id)
         conn.commit()
     except Exception:
         flash('Error deleting playlist.', category="error")
         return redirect(url_for('views.playlist_songs', playlist_id=playlist_id))
 
     cur.close()
-    conn.close()
+    recommendation_cache.invalidate(str(playlist_id))
 
     flash('Playlist deleted.', category="success")
     return redirect(url_for('views.dashboard'))
@@ -321,19 +476,23 @@ def delete_playlist(playlist_id):
 @views.route('/delete_song/<playlist_id>/<song_id>')
 def delete_song(playlist_id, song_id):
     # Delete song from playlist in database
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
     try:
         cur.execute(
             'DELETE FROM playlist_songs WHERE playlist_id = ? AND song_id = ?', (playlist_id, song_id,))
+        if cur.rowcount:
+            update_taste(cur, playlist_id, song_id, -cur.rowcount)
+            bump_playlist_version(cur, playlist_id)
         conn.commit()
     except Exception:
         flash('Error deleting playlist.', category="error")
         return redirect(url_for('views.playlist_songs', playlist_id=playlist_id))
 
     cur.close()
-    conn.close()
+    recommendation_cache.invalidate(str(playlist_id))
+    recommendation_jobs.schedule(playlist_id)
 
     flash('Song deleted.', category="success")
     return redirect(url_for('views.playlist_songs', playlist_id=playlist_id))
@@ -383,40 +542,50 @@ def change():
         update_artist_column = request.form.get('update_artist_column')
         update_artist_new_value = request.form.get('update_artist_new_value')
 
-        conn = sqlite3.connect('Music.db')
+        conn = get_db()
         cur = conn.cursor()
 
+        # Songs, albums, and artists whose names or popularity the edit changes
+        changed_records = []
+
         try:
             # Add new music data to database
             if song_title:
                 query = f'''INSERT INTO song (album_id, artist_id, title, genre, spotify_url) VALUES (?, ?, ?, ?, ?)'''
                 cur.execute(query, (song_album_id, song_artist_id,
                             song_title, song_genre, song_track_url))
+                changed_records = [('song', cur.lastrowid), ('album', song_album_id), ('artist', song_artist_id)]
                 flash("Successfully inserted record.", category="success")
             elif album_title:
                 query = f'''INSERT INTO album (artist_id, title, release_date, image_url) VALUES (?, ?, ?, ?)'''
                 cur.execute(query, (album_artist_id, album_title,
                             album_release_date, album_image_url))
+                changed_records = [('album', cur.lastrowid)]
                 flash("Successfully inserted record.", category="success")
             elif artist_name:
                 query = f'''INSERT INTO artist (name, genre) VALUES (?, ?)'''
                 cur.execute(query, (artist_name, artist_genre))
+                changed_records = [('artist', cur.lastrowid)]
                 flash("Successfully inserted record.", category="success")
             # Remove music data from database
             elif remove_song_id:
+                changed_records = get_song_records(cur, remove_song_id)
                 query = f'''DELETE FROM song WHERE song_id = ?'''
                 cur.execute(query, (remove_song_id,))
                 flash("Successfully deleted record.", category="success")
             elif remove_album_id:
                 query = '''DELETE FROM album Where album_id = ?'''
                 cur.execute(query, (remove_album_id,))
+                changed_records = [('album', remove_album_id)]
                 flash("Successfully deleted record.", category="success")
             elif remove_artist_id:
                 query = f'''DELETE FROM artist WHERE artist_id = ?'''
                 cur.execute(query, (remove_artist_id,))
+                changed_records = [('artist', remove_artist_id)]
                 flash("Successfully deleted record.", category="success")
             # Update music data in database
             elif update_song_id:
+                changed_records = get_song_records(cur, update_song_id)
                 query = f'''UPDATE song SET {update_song_column} = "{
                     update_song_new_value}" WHERE song_id = {update_song_id}'''
                 cur.execute(query)
@@ -425,20 +594,83 @@ def change():
                 query = f'''UPDATE album SET {update_album_column} = "{
                     update_album_new_value}" WHERE album+id = {update_album_id}'''
                 cur.execute(query)
+                changed_records = [('album', update_album_id)]
                 flash("Successfully updated record.", category="success")
             elif update_artist_id:
+                changed_records = [('artist', row[0]) for row in cur.execute(
+                    'SELECT artist_id FROM artist WHERE name = ?', (update_artist_id,)).fetchall()]
                 query = f'''UPDATE Artist SET {update_artist_column} = "{
                     update_artist_new_value}" WHERE name = "{update_artist_id}"'''
                 cur.execute(query)
                 flash("Successfully updated record.", category="success")
+            # Start a new catalogue generation so no worker serves search results read before the edit
+            bump_catalogue_generation(cur)
         except Exception:
             flash(f"Error: Something went wrong.", category="error")
             return render_template('change.html')
 
         conn.commit()
+
+        # Update the changed names in this worker's autocomplete index and catalogue dimensions
+        autocomplete_index.refresh(cur, changed_records)
+        catalogue_dimensions.refresh(cur, changed_records)
+        featured_songs.wake()
+
         cur.close()
-        conn.close()
+
+        # Cached suggestions hold catalogue rows, so any catalogue change drops all of them
+        recommendation_cache.clear()
+        popular_songs_cache.clear()
 
         return render_template("change.html")
     else:
         return render_template("change.html")
+
+# Route to bulk import an uploaded CSV or JSON-lines file of artists, albums, songs, or song features
+@views.route('/import', methods=['POST'])
+def import_catalogue():
+    user = session.get('user', '')
+    if not user or not user.get('admin'):
+        return jsonify({'error': 'Not authorized.'}), 403
+    kind = request.form.get('kind')
+    file = request.files.get('file')
+    if kind not in KINDS or not file or not file.filename:
+        return jsonify({'error': f'Upload a file and a kind, one of {", ".join(KINDS)}.'}), 400
+
+    # The upload is read a line at a time, never as a whole
+    try:
+        report = import_stream(kind, get_text_stream(file), request.form.get('format') or get_format(file.filename),
+                               current_app.config['IMPORT_BATCH_SIZE'])
+    finally:
+        # A bulk import touches too many records to refresh one by one, so this worker's catalogue data is rebuilt,
+        # also after an import that stopped with some batches committed
+        conn = get_db()
+        cur = conn.cursor()
+        autocomplete_index.schedule_build()
+        catalogue_dimensions.load(cur)
+        cur.close()
+        featured_songs.wake()
+        recommendation_cache.clear()
+        popular_songs_cache.clear()
+    if 'error' in report:
+        return jsonify(dict(report, error=f'Import stopped after {report["inserted"]} inserted rows: {report["error"]}')), 400
+    return jsonify(report)
+
+# Route to report cache usage, used to size the caches
+@views.route('/stats')
+def stats():
+    user = session.get('user', '')
+    if not user or not user.get('admin'):
+        flash('Error. Not authorized.', category='error')
+        return redirect(url_for('views.home'))
+    return jsonify({
+        'recommendations': recommendation_cache.stats(),
+        'recommendation_jobs': recommendation_jobs.stats(),
+        'search': search_cache.stats(),
+        'fragments': fragment_cache.stats(),
+        'search_shared': dict(shared_cache_stats),
+        'autocomplete': autocomplete_index.stats(),
+        'catalogue': catalogue_dimensions.stats(),
+        'database': db_pool.stats(),
+        'featured_songs': featured_songs.stats(),
+    })